@@ -1,78 +1,128 @@
-import os
 import sys
-from threading import Thread
-import esptool
-import json
-from collections import OrderedDict
+import time
+from threading import Thread, RLock
 from PUI.PySide6 import *
 import PUI
-import tempfile
-import atexit
-import shutil
-import esptool
 
-VERSION = "0.14.1"
+FRAME_RATE = 15 # Hz, how often worker updates are pushed to the UI
 
 from .common import *
-from .bmp import BMPBackend
-from .dfu import DFUBackend
-from .esp import ESPBackend
-from .openocd import OpenOCDBackend
-from .py_ocd import PyOCDBackend
-
-class TaskContext(StateObject):
-    def __init__(self, main):
+from .events import *
+from .logstore import LogStore, DEFAULT_LOG_LINES
+from .logview import LogView
+from .device_table import DeviceTable
+from .session import FlashSession
+from .version import VERSION
+
+class TaskContext(StateObject, TaskEvents):
+    def __init__(self, main, log_lines=DEFAULT_LOG_LINES):
         super().__init__()
+        self._changed = False
+        self._pending = {}
+        self._pending_lock = RLock()
         self.main = main
         self.port = None
-        self.done = False
+        self.status = ""
         self.ok = True
         self.mac = ""
         self.progress = 0
-        self.logs = []
+        self.log_seq = (0, 0)
+        self.monitor_seq = (0, 0)
+        self.logs = LogStore(log_lines, main.temp_dir, "log", self.logs_changed)
         self.monitor_proc = None
-        self.monitor_logs = []
+        self.monitor_logs = LogStore(log_lines, main.temp_dir, "monitor", self.logs_changed)
+        self.events = EventBus()
+        self.events.subscribe(self.apply_event)
+
+    def __setattr__(self, key, value):
+        # a direct assignment supersedes a deferred one for the same field
+        lock = self.__dict__.get("_pending_lock")
+        if lock is None or key.startswith("_"):
+            return super().__setattr__(key, value)
+        with lock:
+            self._pending.pop(key, None)
+            self._changed = True
+            super().__setattr__(key, value)
+
+    def defer(self, key, value):
+        """
+        Set a frequently updated field on the next UI frame instead of now
+        """
+        with self._pending_lock:
+            self._pending[key] = value
+
+    def flush(self):
+        """
+        Apply deferred fields, returns whether anything changed since the last flush
+        """
+        with self._pending_lock:
+            pending = self._pending
+            self._pending = {}
+            for key, value in pending.items():
+                super().__setattr__(key, value)
+            changed = self._changed or bool(pending)
+            self._changed = False
+        return changed
+
+    def logs_changed(self, store):
+        seq = (store.generation, store.end)
+        if store is self.logs:
+            self.defer("log_seq", seq)
+        else:
+            self.defer("monitor_seq", seq)
+
+    def set_log_lines(self, log_lines):
+        self.logs.cap = log_lines
+        self.monitor_logs.cap = log_lines
+
+    def apply_event(self, event):
+        if isinstance(event, LogLine):
+            self.logs.append(event.line)
+        elif isinstance(event, Error):
+            self.logs.append(f"Error: {event.message}")
+        elif isinstance(event, Progress):
+            self.defer("progress", event.percent)
+        elif isinstance(event, Result):
+            self.ok = event.ok
+        elif isinstance(event, MacFound):
+            self.mac = event.mac
+        elif isinstance(event, StageEnd):
+            self.logs.append(f"{event.name}: {'ok' if event.ok else 'failed'} in {event.duration:.2f}s")
+
+class UI(Application, FlashSession):
+    context_class = TaskContext
 
-class UI(Application):
     def __init__(self):
         super().__init__(icon=resource_path("icon.ico"))
-        self.temp_dir = tempfile.mkdtemp(prefix="fw_flasher_")
-        atexit.register(self.cleanup)
-
-        self.state = state = State()
+        FlashSession.__init__(self, State())
         self.state.port = ""
-        self.state.profile = ""
-        self.state.profiles = {}
-        self.state.root = ""
-        self.state.worker = None
-        self.state.init_ports = set()
-        self.state.working_ports = set()
-        self.state.idle_ports = set()
-        self.state.batch_worker = OrderedDict()
-        self.state.batch_flash = False
-        self.state.erase_flash = False
-        self.state.ports = []
-        self.state.batch_context = []
+        self.state.batch_frame = 0
+        self.state.batch_stats = ""
         self.state.focus = None
 
-        self.context = TaskContext(self)
-
-        self.manifest_dir = None
-        self.backend = None
-
         Thread(target=self.ports_watcher, daemon=True).start()
+        Thread(target=self.refresher, daemon=True).start()
 
-    def cleanup(self):
-        proc = self.context.monitor_proc
-        self.context.monitor_proc = None
-        if proc:
-            proc.terminate()
-        if os.path.exists(self.temp_dir):
-            shutil.rmtree(self.temp_dir)
+    def refresher(self):
+        generation = self.registry.generation
+        while True:
+            time.sleep(1 / FRAME_RATE)
+            self.context.flush()
+            changed = generation != self.registry.generation
+            generation = self.registry.generation
+            for context in self.registry.contexts():
+                changed = context.flush() or changed
+            if changed:
+                self.state.batch_frame += 1
+            scheduler = self.scheduler
+            if scheduler:
+                self.state.batch_stats = self.format_batch_stats(scheduler.stats())
 
     def ports_watcher(self):
+        generation = self.hotplug.generation
         while True:
             try:
+                self.refresh_plan()
                 profile = self.state.profiles.get(self.state.profile)
                 if profile:
                     backend = self.getBackend(profile)
@@ -82,42 +132,19 @@ class UI(Application):
                         ports = []
                     self.state.ports = ports
                     if self.state.batch_flash:
-                        current_ports = set(ports)
-                        removed_ports = (self.state.init_ports | self.state.working_ports | self.state.idle_ports) - current_ports
-
-                        new_ports = current_ports - self.state.init_ports - self.state.working_ports - self.state.idle_ports
-                        # print("Removed ports: ", removed_ports)
-                        # print("New ports: ", new_ports)
-
-                        for p in removed_ports:
-                            try:
-                                self.state.idle_ports.remove(p)
-                            except KeyError:
-                                pass
-                            try:
-                                self.state.working_ports.remove(p)
-                            except KeyError:
-                                pass
-                            try:
-                                self.state.init_ports.remove(p)
-                            except KeyError:
-                                pass
-                        self.state.batch_context = [c for c in self.state.batch_context if c.port not in removed_ports]
-
-                        for p in new_ports:
-                            self.state.working_ports.add(p)
-                            Thread(target=self.batch_worker, args=[profile, backend, p], daemon=True).start()
-
-                        self.state.init_ports -= removed_ports
-                        self.state.working_ports -= removed_ports
-                        self.state.idle_ports -= removed_ports
+                        self.batch_sync(profile, backend, ports)
             except:
                 import traceback
                 traceback.print_exc()
-            time.sleep(1)
+            # wakes up on hotplug or a profile change, polls on platforms without events
+            generation = self.hotplug.wait(generation, self.hotplug.interval())
 
     def content(self):
-        title = f"Firmware Flasher v{VERSION} (esptool {esptool.__version__}, PUI {PUI.__version__} {PUI_BACKEND})"
+        versions = [f"PUI {PUI.__version__} {PUI_BACKEND}"]
+        esptool = sys.modules.get("esptool") # only loaded once an ESP profile is selected
+        if esptool:
+            versions.insert(0, f"esptool {esptool.__version__}")
+        title = f"Firmware Flasher v{VERSION} ({', '.join(versions)})"
         with Window(title=title, size=(800, 600), icon=resource_path("icon.ico")).keypress(self.keypress):
             with VBox():
                 with HBox():
@@ -161,24 +188,12 @@ class UI(Application):
                     Spacer()
 
                 if self.state.batch_flash:
-                    with Scroll().layout(weight=1):
-                        with VBox():
-                            for context in self.state.batch_context:
-                                print(context.port)
-                                with HBox():
-                                    Label(context.port)
-                                    if self.backend and self.backend.show_mac:
-                                        Label("MAC:")
-                                        TextField(context("mac"))
-                                    ProgressBar(progress=context.progress, maximum=100).layout(weight=1)
-                                    Label("Done" if context.done and context.ok else ("" if context.ok else "Error"))
-                                    Button("Logs").click(lambda e, context: self.set_focus(context), context)
-                            if self.state.focus:
-                                Label(self.state.focus.port)
-                                with Scroll().layout(weight=1).scrollY(Scroll.END):
-                                    Text("\n".join(self.state.focus.logs))
-                            else:
-                                Spacer()
+                    columns = ["port", "mac", "progress", "status"] if self.backend and self.backend.show_mac else ["port", "progress", "status"]
+                    Label(self.state.batch_stats)
+                    DeviceTable(self.registry.contexts(), columns, self.state.batch_frame).click(lambda e: self.set_focus(e.value)).layout(weight=1)
+                    if self.state.focus:
+                        Label(self.state.focus.port)
+                        LogView(self.state.focus.logs, self.state.focus.log_seq).layout(weight=1)
                 else:
                     if self.backend and self.backend.show_mac:
                         with HBox():
@@ -188,12 +203,10 @@ class UI(Application):
                     if self.backend and self.backend.show_progress:
                         ProgressBar(progress=self.context.progress, maximum=100)
                     with HBox():
-                        with Scroll().layout(weight=1).scrollY(Scroll.END):
-                            Text("\n".join(self.context.logs))
+                        LogView(self.context.logs, self.context.log_seq).layout(weight=1)
 
                         if self.backend and self.backend.show_monitor and self.state.profile and self.state.profiles[self.state.profile].get("monitor"):
-                            with Scroll().layout(weight=1).scrollY(Scroll.END):
-                                Text("\n".join(self.context.monitor_logs))
+                            LogView(self.context.monitor_logs, self.context.monitor_seq).layout(weight=1)
 
 
     def set_focus(self, context):
@@ -205,57 +218,30 @@ class UI(Application):
 
     def changeProfile(self, e):
         backend = self.getBackend(self.state.profiles[self.state.profile])
-        if backend and backend != self.backend:
-            self.context.logs = []
-            backend.precheck(self)
+        self.context.set_log_lines(self.state.profiles[self.state.profile].get("log-lines", DEFAULT_LOG_LINES))
+        if not backend:
+            self.context.error(self.backend_error(self.state.profiles[self.state.profile]))
+        elif backend != self.backend:
+            self.context.logs.clear()
+            backend.precheck(self.context)
             self.backend = backend
             self.state.port = "Auto"
         self.state.erase_flash = self.state.profiles[self.state.profile].get("erase-flash", False)
+        self.hotplug.notify()
 
     def load_manifest(self):
-        file = OpenFile("Open Manifest", types="Manifest JSON (*.json)|.*json", dir=self.manifest_dir)
+        file = OpenFile("Open Manifest", types="Manifest or Firmware Bundle (*.json *.fwb)|Manifest JSON (*.json)|Firmware Bundle (*.fwb)", dir=self.manifest_dir)
         if file:
             self.loadFile(file)
 
     def loadFile(self, file):
-        self.context.logs = []
-        with open(file, "r") as f:
-            try:
-                self.state.profiles = json.load(f, object_pairs_hook=OrderedDict)
-            except Exception as e:
-                import traceback
-                self.context.logs.append(f"Error: {traceback.format_exc()}")
-                return
-            use_bmp = False
-            if self.state.profiles:
-                self.manifest_dir = os.path.dirname(file)
-                for name, profile in self.state.profiles.items():
-                    backend = self.getBackend(profile)
-                    if not backend:
-                        self.context.logs.append(f"Unsupported chip type \"{profile.get('type')}\" in profile \"{name}\"")
-                self.state.profile = list(self.state.profiles.keys())[0]
-                self.state.root = os.path.abspath(os.path.dirname(file))
-                self.changeProfile(None)
-
-    def getBackend(self, profile):
-        if not profile:
-            return None
-        if profile.get("type", "").startswith("esp"):
-            return ESPBackend
-        elif profile.get("type", "") == "bmp":
-            return BMPBackend
-        elif profile.get("type", "") == "openocd":
-            return OpenOCDBackend
-        elif profile.get("type", "") == "dfu":
-            return DFUBackend
-        elif profile.get("type", "") == "pyocd":
-            return PyOCDBackend
-        else:
-            print("Unsupported chip type: %s" % profile.get("type"))
-            return None
+        self.context.logs.clear()
+        if self.load_profiles(file) and self.state.profiles:
+            self.changeProfile(None)
+            Thread(target=self.prepare_images, args=[self.state.profiles, self.plan], daemon=True).start()
 
     def flash(self):
-        self.context.progress = 0
+        self.context.report_progress(0, 100)
         profile = self.state.profiles.get(self.state.profile)
         if not profile:
             return
@@ -265,40 +251,3 @@ class UI(Application):
         backend = self.getBackend(profile)
         if backend:
             Thread(target=self.thread_watcher, args=[backend.flash, self.context, port, profile, backend], daemon=True).start()
-
-    def batch_start(self):
-        self.state.init_ports = set(self.state.ports)
-        self.state.batch_new_ports = set()
-        self.state.working_ports = set()
-        self.state.batch_worker = OrderedDict()
-        self.state.batch_flash = True
-
-    def batch_stop(self):
-        self.state.batch_flash = False
-
-    def batch_worker(self, profile, backend, port):
-        context = TaskContext(self)
-        context.port = port
-        self.state.batch_context.append(context)
-        t = Thread(target=self.thread_watcher, args=[backend.flash, context, port, profile, backend], daemon=True)
-        t.start()
-        t.join()
-
-    # esp*.main quit current thread without returning, so wrap it in a thread for post-return processing
-    def thread_watcher(self, func, context, port, profile, backend):
-        port = backend.determine_port(context, profile, port)
-        self.state.working_ports.add(port)
-        self.context.ok = False
-
-        worker = Thread(target=func, args=[context, port, profile], daemon=True)
-        self.state.worker = worker
-        worker.start()
-        worker.join()
-        if self.context.ok:
-            print("Done")
-            self.context.logs.append("Done")
-        else:
-            self.context.logs.append("Error")
-        self.state.worker = None
-        self.state.idle_ports.add(port)
-        self.state.working_ports.remove(port)
@@ -1,24 +1,31 @@
 import sys
 import os
-import esptool
 
-from .FwFlasher import UI
-
-from .FwFlasher import VERSION as __version__
+from .version import VERSION as __version__
 
 def main(args=None):
     if args is None:
         args = sys.argv[1:]
-    ui = UI()
 
     if len(args) > 0:
         if args[0] == "esptool":
-            esptool.main(args[1:])
+            from . import esptool_worker
+            esptool_worker.main(args[1:])
             return
-        else:
-            ui.loadFile(args[0])
+        elif args[0] == "flash":
+            # headless, never imports Qt
+            from .cli import main as cli_main
+            sys.exit(cli_main(args[1:]))
+        elif args[0] == "bundle":
+            from .cli import bundle_main
+            sys.exit(bundle_main(args[1:]))
+
+    from .FwFlasher import UI
+    ui = UI()
+
+    if len(args) > 0:
+        ui.loadFile(args[0])
     elif os.path.exists("manifest/manifest.json"):
         ui.loadFile("manifest/manifest.json")
 
     ui.run()
-
@@ -1,4 +1,5 @@
 import sys
 from . import main
 
-main(sys.argv[1:])
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,48 @@
+"""
+Backends by profile "type", imported on first use so a station only pays for
+the tool stack (esptool, pyOCD, ...) of the profiles it actually selects
+"""
+
+import importlib
+import threading
+
+BACKENDS = {
+    "esp": ("esp", "ESPBackend"), # esp32, esp32c3, ...
+    "bmp": ("bmp", "BMPBackend"),
+    "openocd": ("openocd", "OpenOCDBackend"),
+    "dfu": ("dfu", "DFUBackend"),
+    "pyocd": ("py_ocd", "PyOCDBackend"),
+}
+
+loaded = {}
+errors = {} # kind -> ImportError, a missing dependency isn't retried on every port scan
+loaded_lock = threading.Lock()
+
+def backend_kind(profile):
+    """
+    BACKENDS key for a profile, None if the type is unsupported; imports nothing
+    """
+    type = profile.get("type", "")
+    if type.startswith("esp"):
+        return "esp"
+    if type in BACKENDS:
+        return type
+    return None
+
+def load(kind):
+    """
+    Backend class for a kind, raises ImportError if its dependencies are missing
+    """
+    with loaded_lock:
+        if kind in loaded:
+            return loaded[kind]
+        if kind in errors:
+            raise errors[kind]
+        module, name = BACKENDS[kind]
+        try:
+            backend = getattr(importlib.import_module(f".{module}", __package__), name)
+        except ImportError as e:
+            errors[kind] = e
+            raise
+        loaded[kind] = backend
+        return backend
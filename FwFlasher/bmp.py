@@ -8,6 +8,7 @@ from .common import *
 import subprocess
 import serial
 
+@cache_found
 def find_arm_none_eabi_gdb():
     try:
         base_path = sys._MEIPASS
@@ -24,8 +25,6 @@ def find_arm_none_eabi_gdb():
             return arm_none_eabi_gdb[0]
     return shutil.which("arm-none-eabi-gdb")
 
-arm_none_eabi_gdb = find_arm_none_eabi_gdb()
-
 class BMPBackend(Backend):
     erase_flash = None
     show_progress = True
@@ -61,14 +60,16 @@ class BMPBackend(Backend):
 
     @staticmethod
     def precheck(context):
+        arm_none_eabi_gdb = find_arm_none_eabi_gdb()
         if arm_none_eabi_gdb:
             print(f"Found {arm_none_eabi_gdb}")
         else:
-            context.logs.append("Error: arm-none-eabi-gdb not found")
+            context.error("arm-none-eabi-gdb not found")
 
     @staticmethod
     def twpr_cycle(context, port):
-        context.logs.append(f"TPWR power cycle")
+        arm_none_eabi_gdb = find_arm_none_eabi_gdb()
+        context.log(f"TPWR power cycle")
         cmd = [
             arm_none_eabi_gdb,
             "--interpreter=mi",
@@ -77,10 +78,10 @@ class BMPBackend(Backend):
             "-ex", "quit",
         ]
         print(" ".join(cmd))
-        context.logs.append(" ".join(cmd))
-        for line in spawn_gdbmi(cmd):
+        context.log(" ".join(cmd))
+        for line in spawn_gdbmi(cmd, context=context):
             line = strip(line)
-            context.logs.append(line)
+            context.log(line)
         time.sleep(1)
 
         cmd = [
@@ -91,30 +92,24 @@ class BMPBackend(Backend):
             "-ex", "quit",
         ]
         print(" ".join(cmd))
-        context.logs.append(" ".join(cmd))
-        for line in spawn_gdbmi(cmd):
+        context.log(" ".join(cmd))
+        for line in spawn_gdbmi(cmd, context=context):
             line = strip(line)
-            context.logs.append(line)
+            context.log(line)
         time.sleep(0.1)
 
     @staticmethod
     def flash(context, port, profile):
+        arm_none_eabi_gdb = find_arm_none_eabi_gdb()
         if not arm_none_eabi_gdb:
             return
 
-        context.monitor_logs = []
+        context.monitor_logs.clear()
 
-        context.logs = []
-        context.progress = 0
+        context.logs.clear()
+        context.report_progress(0, 100)
 
-        file = profile.get('load', '')
-        if os.path.isabs(file):
-            pass
-        else:
-            file = os.path.join(context.main.state.root, file)
-        if not os.path.exists(file):
-            context.logs.append(f"Error: File not found: {file}")
-            return
+        file = context.main.plan.path(profile.get('load', ''))
 
         if port == "Auto":
             ports = BMPBackend.list_ports(context, profile)
@@ -124,10 +119,10 @@ class BMPBackend(Backend):
                 port = None
 
         if not port:
-            context.logs.append("Error: BMP port not found")
+            context.error("BMP port not found")
             return
 
-        context.ok = False
+        context.report_result(False)
 
         if profile.get("tpwr", True):
             BMPBackend.twpr_cycle(context, port)
@@ -150,37 +145,38 @@ class BMPBackend(Backend):
             "-ex", "quit",
         ])
         print(" ".join(cmd))
-        context.ok = True
-        context.logs.append(" ".join(cmd))
-        for line in spawn_gdbmi(cmd):
-            line = strip(line)
-            if line.startswith("+download,"):
-                kv = {k:v[1:-1] for k,v in [kv.split("=") for kv in line[11:-1].split(",")]}
-                if "total-size" in kv and "total-sent" in kv:
-                    context.progress = int(int(kv["total-sent"]) / int(kv["total-size"]) * 100)
-                context.main.wait()
-            if "Error" in line:
-                context.ok = False
-            context.logs.append(line)
+        context.report_result(True)
+        context.log(" ".join(cmd))
+        with context.stage("write"):
+            for line in spawn_gdbmi(cmd, context=context):
+                line = strip(line)
+                if line.startswith("+download,"):
+                    kv = {k:v[1:-1] for k,v in [kv.split("=") for kv in line[11:-1].split(",")]}
+                    if "total-size" in kv and "total-sent" in kv:
+                        context.report_progress(int(kv["total-sent"]), int(kv["total-size"]))
+                if "Error" in line:
+                    context.report_result(False)
+                context.log(line)
         if context.ok:
-            context.progress = 100
-            context.done = True
-            context.logs.append("Flash done")
+            context.report_progress(100, 100)
+            context.log("Flash done")
 
             if profile.get("monitor", False):
-                BMPBackend.monitor(context, port, profile)
+                with context.stage("monitor"):
+                    BMPBackend.monitor(context, port, profile)
         else:
-            context.logs.append("Flash error")
-            context.progress = 0
+            context.log("Flash error")
+            context.report_progress(0, 100)
 
         if profile.get("tpwr", True):
             BMPBackend.twpr_cycle(context, port)
 
     def monitor(context, port, profile):
+        arm_none_eabi_gdb = find_arm_none_eabi_gdb()
         monitor_port = BMPBackend.get_monitor_port(context, port)
         if not monitor_port:
             return
-        context.logs.append(f"Monitor start on port {monitor_port}")
+        context.log(f"Monitor start on port {monitor_port}")
         cmd = [
             arm_none_eabi_gdb,
             "--interpreter=mi",
@@ -192,16 +188,30 @@ class BMPBackend(Backend):
             "-ex", f"run",
             "-ex", "quit",
         ]
-        context.monitor_proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        proc = context.monitor_proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
         ser = serial.Serial(monitor_port, 115200, timeout=0.25)
-        while context.monitor_proc and context.monitor_proc.poll() is None:
-            line = ser.readline()
-            if not line:
-                continue
-            line = line.decode("utf-8").rstrip("\r\n")
-            line = re.sub(r"\x1b\[[0-9;]*m", "", line)
-            context.monitor_logs.append(line)
-            context.main.wait()
+        release = context.on_cancel(lambda: (proc.kill(), ser.close()))
+        timeout = profile.get("timeouts", {}).get("monitor")
+        deadline = time.monotonic() + timeout if timeout else None
+        try:
+            while context.monitor_proc and context.monitor_proc.poll() is None:
+                if deadline and time.monotonic() > deadline:
+                    context.log(f"Monitor stopped after {timeout}s")
+                    proc.kill()
+                    proc.wait()
+                    break
+                line = ser.readline()
+                if not line:
+                    continue
+                line = line.decode("utf-8").rstrip("\r\n")
+                line = re.sub(r"\x1b\[[0-9;]*m", "", line)
+                context.monitor_logs.append(line)
+        except (OSError, TypeError, serial.SerialException):
+            # the port was closed under us by a cancel
+            if not context.cancelled:
+                raise
+        finally:
+            release()
         ser.close()
         context.monitor_proc = None
-        context.logs.append("Monitor done")
\ No newline at end of file
+        context.log("Monitor done")
\ No newline at end of file
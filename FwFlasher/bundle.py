@@ -0,0 +1,209 @@
+"""
+Firmware bundle (.fwb): a manifest and every file it refers to in one
+uncompressed zip, so a station is deployed with a single atomic copy.
+
+    manifest.json       the manifest, paths unchanged
+    blobs/<sha256>      file contents, stored once per distinct content
+    index.json          manifest path -> sha256, blob sizes
+    index.sig           optional Ed25519 signature over index.json
+
+Members are stored, not deflated, so a loaded bundle is one read-only
+mmap and every member is a zero-copy memoryview into it.
+"""
+
+import os
+import json
+import mmap
+import struct
+import hashlib
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from . import backends
+from .manifest import compile_manifest, profile_files, HASH_WORKERS
+
+BUNDLE_SUFFIX = ".fwb"
+BUNDLE_FORMAT = 1
+MANIFEST = "manifest.json"
+INDEX = "index.json"
+SIGNATURE = "index.sig"
+
+class BundleError(Exception):
+    pass
+
+def bundle_refs(profiles):
+    """
+    Relative file references of all profiles, OpenOCD scripts belong to the tool and aren't bundled
+    """
+    refs = set()
+    for name, profile in profiles.items():
+        kind = backends.backend_kind(profile)
+        if not kind:
+            continue
+        for file, base in profile_files(kind, profile):
+            if not file or base is not None:
+                continue
+            if os.path.isabs(file) or os.path.normpath(file).split(os.sep)[0] == os.pardir:
+                raise BundleError(f"{file} in profile \"{name}\" is outside the manifest directory")
+            refs.add(file)
+    return sorted(refs)
+
+def load_key(path, private):
+    try:
+        from cryptography.hazmat.primitives import serialization
+    except ImportError:
+        raise BundleError("Signed bundles need the cryptography package")
+    with open(path, "rb") as f:
+        data = f.read()
+    if private:
+        return serialization.load_pem_private_key(data, password=None)
+    return serialization.load_pem_public_key(data)
+
+def build(manifest_file, output, sign_key=None):
+    """
+    Bundle a manifest and its files into `output`, written atomically
+    """
+    with open(manifest_file, "rb") as f:
+        manifest = f.read()
+    try:
+        profiles = json.loads(manifest)
+    except ValueError as e:
+        raise BundleError(f"{manifest_file}: {e}")
+    root = os.path.dirname(os.path.abspath(manifest_file))
+    refs = bundle_refs(profiles)
+    plan = compile_manifest(profiles, root)
+    for name, errors in plan.errors.items():
+        raise BundleError(f"{errors[0]} in profile \"{name}\"")
+
+    files = {ref: plan.sha256(ref) for ref in refs}
+    blobs = {}
+    for ref in refs:
+        blobs.setdefault(files[ref], plan.path(ref))
+    index = {
+        "format": BUNDLE_FORMAT,
+        "manifest": hashlib.sha256(manifest).hexdigest(),
+        "files": files,
+        "blobs": {sha256: os.path.getsize(path) for sha256, path in blobs.items()},
+    }
+    index = json.dumps(index, indent=2, sort_keys=True).encode()
+
+    partial = output + ".part"
+    with zipfile.ZipFile(partial, "w", zipfile.ZIP_STORED) as zf:
+        zf.writestr(INDEX, index)
+        if sign_key:
+            zf.writestr(SIGNATURE, load_key(sign_key, private=True).sign(index))
+        zf.writestr(MANIFEST, manifest)
+        for sha256, path in sorted(blobs.items()):
+            zf.write(path, f"blobs/{sha256}")
+    os.replace(partial, output)
+    return len(files), len(blobs)
+
+class Bundle():
+    """
+    A bundle mapped read-only; read() returns memoryviews into the mapping
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.view = memoryview(self.map)
+            self.members = {}
+            with zipfile.ZipFile(self.file) as zf:
+                for info in zf.infolist():
+                    if info.compress_type != zipfile.ZIP_STORED:
+                        raise BundleError(f"{info.filename} is compressed")
+                    # member data follows the local header, whose name/extra lengths may differ from the central directory
+                    offset = info.header_offset
+                    if self.map[offset:offset + 4] != b"PK\x03\x04":
+                        raise BundleError(f"{info.filename}: bad local header")
+                    name_len, extra_len = struct.unpack_from("<HH", self.map, offset + 26)
+                    start = offset + 30 + name_len + extra_len
+                    self.members[info.filename] = (start, info.file_size)
+            self.index = json.loads(bytes(self.read(INDEX)))
+        except (zipfile.BadZipFile, KeyError, ValueError) as e:
+            self.close()
+            raise BundleError(f"{path}: not a firmware bundle ({e})")
+        except Exception:
+            self.close()
+            raise
+
+    def read(self, name):
+        try:
+            start, size = self.members[name]
+        except KeyError:
+            raise BundleError(f"{self.path}: {name} missing")
+        return self.view[start:start + size]
+
+    def blob(self, sha256):
+        return self.read(f"blobs/{sha256}")
+
+    def verify(self, trusted_key=None):
+        """
+        Check the signature against `trusted_key` (PEM public key) if given, then every content hash
+        """
+        if not isinstance(self.index, dict) or self.index.get("format") != BUNDLE_FORMAT:
+            raise BundleError(f"{self.path}: unsupported bundle format")
+        for key, kind in (("manifest", str), ("files", dict), ("blobs", dict)):
+            if not isinstance(self.index.get(key), kind):
+                raise BundleError(f"{self.path}: index.json has no valid \"{key}\"")
+        if trusted_key:
+            if SIGNATURE not in self.members:
+                raise BundleError(f"{self.path} is not signed")
+            key = load_key(trusted_key, private=False)
+            from cryptography.exceptions import InvalidSignature
+            try:
+                key.verify(bytes(self.read(SIGNATURE)), bytes(self.read(INDEX)))
+            except InvalidSignature:
+                raise BundleError(f"{self.path}: bad signature")
+
+        checks = [(MANIFEST, self.read(MANIFEST), self.index["manifest"])]
+        for sha256, size in self.index["blobs"].items():
+            data = self.blob(sha256)
+            if len(data) != size:
+                raise BundleError(f"{self.path}: blob {sha256} is truncated")
+            checks.append((f"blobs/{sha256}", data, sha256))
+        with ThreadPoolExecutor(HASH_WORKERS) as pool:
+            digests = pool.map(lambda check: hashlib.sha256(check[1]).hexdigest(), checks)
+            for (name, data, expected), digest in zip(checks, digests):
+                if digest != expected:
+                    raise BundleError(f"{self.path}: {name} is corrupted")
+        for ref, sha256 in self.index["files"].items():
+            if sha256 not in self.index["blobs"]:
+                raise BundleError(f"{self.path}: no content for {ref}")
+            if os.path.isabs(ref) or os.pardir in ref.replace("\\", "/").split("/"):
+                raise BundleError(f"{self.path}: {ref} is outside the bundle")
+
+    def extract(self, directory):
+        """
+        Lay the manifest and its files out under `directory` for the external tools, returns the manifest path
+        """
+        manifest = os.path.join(directory, MANIFEST)
+        with open(manifest, "wb") as f:
+            f.write(self.read(MANIFEST))
+        for ref, sha256 in self.index["files"].items():
+            path = os.path.join(directory, ref)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(self.blob(sha256))
+        return manifest
+
+    def sources(self, directory):
+        """
+        Extracted path -> memoryview of its content in the mapping
+        """
+        return {os.path.join(directory, ref): self.blob(sha256) for ref, sha256 in self.index["files"].items()}
+
+    def close(self):
+        view = getattr(self, "view", None)
+        mapping = getattr(self, "map", None)
+        self.view = self.map = None
+        try:
+            if view is not None:
+                view.release()
+            if mapping is not None:
+                mapping.close()
+        except BufferError:
+            # slices still handed out, the mapping goes away with them
+            pass
+        self.file.close()
@@ -0,0 +1,132 @@
+import heapq
+import itertools
+import threading
+import time
+
+from .events import StageStart, StageEnd
+
+class Cancelled(Exception):
+    pass
+
+class CancelScope():
+    """
+    What to kill or close when a flash is cancelled: child processes, serial
+    ports, debug probe sessions. cancel() runs every registered callback once,
+    callbacks added afterwards run immediately.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.callbacks = {}
+        self.ids = itertools.count()
+        self.cancelled = False
+        self.reason = None
+        self.event = threading.Event() # set on cancel, or by finish()
+
+    def add(self, callback):
+        with self.lock:
+            if not self.cancelled:
+                token = next(self.ids)
+                self.callbacks[token] = callback
+                return token
+        self.call(callback)
+        return None
+
+    def remove(self, token):
+        with self.lock:
+            self.callbacks.pop(token, None)
+
+    def cancel(self, reason="Cancelled"):
+        with self.lock:
+            if self.cancelled:
+                return False
+            self.cancelled = True
+            self.reason = reason
+            callbacks = list(self.callbacks.values())
+            self.callbacks.clear()
+        for callback in callbacks:
+            self.call(callback)
+        self.event.set()
+        return True
+
+    def finish(self):
+        self.event.set()
+
+    def check(self):
+        if self.cancelled:
+            raise Cancelled(self.reason)
+
+    @staticmethod
+    def call(callback):
+        try:
+            callback()
+        except Exception:
+            import traceback
+            traceback.print_exc()
+
+class Watchdog():
+    """
+    One timer thread for every armed deadline, instead of a Timer per stage
+    """
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.heap = []
+        self.ids = itertools.count()
+        self.armed = {}
+        self.thread = None
+
+    def arm(self, timeout, callback):
+        with self.cond:
+            token = next(self.ids)
+            self.armed[token] = callback
+            heapq.heappush(self.heap, (time.monotonic() + timeout, token))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+            self.cond.notify()
+            return token
+
+    def disarm(self, token):
+        with self.cond:
+            self.armed.pop(token, None)
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.heap or self.heap[0][0] > time.monotonic():
+                    self.cond.wait(self.heap[0][0] - time.monotonic() if self.heap else None)
+                deadline, token = heapq.heappop(self.heap)
+                callback = self.armed.pop(token, None)
+            if callback:
+                CancelScope.call(callback)
+
+watchdog = Watchdog()
+
+# stages the backend ends by itself when their time is up, running out of it doesn't fail the device
+SOFT_STAGES = ("monitor",)
+
+class StageTimeouts():
+    """
+    Cancels `scope` when a stage reported on `events` outlives its entry in
+    the profile's "timeouts" (seconds per stage name)
+    """
+    def __init__(self, events, timeouts, scope):
+        self.timeouts = timeouts or {}
+        self.scope = scope
+        self.armed = {}
+        self.unsubscribe = events.subscribe(self.on_event)
+
+    def on_event(self, event):
+        if isinstance(event, StageStart):
+            timeout = self.timeouts.get(event.name)
+            if timeout and event.name not in SOFT_STAGES:
+                self.armed[event.name] = watchdog.arm(timeout, lambda: self.scope.cancel(f"{event.name} timed out after {timeout}s"))
+        elif isinstance(event, StageEnd):
+            token = self.armed.pop(event.name, None)
+            if token is not None:
+                watchdog.disarm(token)
+
+    def close(self):
+        self.unsubscribe()
+        for token in self.armed.values():
+            watchdog.disarm(token)
+        self.armed.clear()
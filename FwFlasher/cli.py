@@ -0,0 +1,259 @@
+"""
+Headless flashing for production stations, no Qt involved:
+
+    python -m FwFlasher flash --manifest manifest.json --profile NAME [--ports PORT ...]
+    python -m FwFlasher flash --manifest manifest.json --profile NAME --batch [--count N]
+    python -m FwFlasher bundle --manifest manifest.json --output firmware.fwb [--sign-key key.pem]
+
+Progress is printed as one JSON object per line on stdout, anything the
+tools print goes to stderr. Exit status is 0 when every device flashed, 1
+when one failed (or none was found), 2 for manifest/profile errors.
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import threading
+
+from .events import *
+from .logstore import LogStore, DEFAULT_LOG_LINES
+from .session import FlashSession
+from .registry import QUEUED, FLASHING, DONE, FAILED
+from .bundle import build as build_bundle, BundleError, BUNDLE_SUFFIX
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+
+class State():
+    """
+    Plain attribute bag standing in for the GUI's reactive State
+    """
+    pass
+
+class Printer():
+    def __init__(self, out, verbose=False):
+        self.out = out
+        self.verbose = verbose
+        self.lock = threading.Lock()
+
+    def emit(self, port, event, **fields):
+        record = {"time": round(time.time(), 3), "port": port, "event": event}
+        record.update(fields)
+        line = json.dumps(record)
+        with self.lock:
+            self.out.write(line + "\n")
+            self.out.flush()
+
+class CLIContext(TaskEvents):
+    def __init__(self, main, log_lines=DEFAULT_LOG_LINES):
+        self.main = main
+        self.port = None
+        self.status = ""
+        self.ok = True
+        self.mac = ""
+        self.progress = 0
+        self.percent = None
+        self.monitor_seq = 0
+        self.logs = LogStore(log_lines, main.temp_dir, "log")
+        self.monitor_proc = None
+        self.monitor_logs = LogStore(log_lines, main.temp_dir, "monitor", self.monitor_changed)
+        self.events = EventBus()
+        self.events.subscribe(self.apply_event)
+
+    def apply_event(self, event):
+        printer = self.main.printer
+        if isinstance(event, LogLine):
+            self.logs.append(event.line)
+            if printer.verbose:
+                printer.emit(self.port, "log", line=event.line)
+        elif isinstance(event, Error):
+            self.logs.append(f"Error: {event.message}")
+            printer.emit(self.port, "error", message=event.message)
+        elif isinstance(event, Progress):
+            self.progress = event.percent
+            percent = int(event.percent)
+            if percent != self.percent:
+                self.percent = percent
+                printer.emit(self.port, "progress", percent=percent)
+        elif isinstance(event, Result):
+            self.ok = event.ok
+        elif isinstance(event, MacFound):
+            self.mac = event.mac
+            printer.emit(self.port, "mac", mac=event.mac)
+        elif isinstance(event, StageStart):
+            printer.emit(self.port, "stage-start", stage=event.name)
+        elif isinstance(event, StageEnd):
+            self.logs.append(f"{event.name}: {'ok' if event.ok else 'failed'} in {event.duration:.2f}s")
+            printer.emit(self.port, "stage-end", stage=event.name, ok=event.ok, duration=round(event.duration, 3))
+
+    def monitor_changed(self, store):
+        generation, end, lines = store.since(self.monitor_seq)
+        self.monitor_seq = end
+        for line in lines:
+            self.main.printer.emit(self.port, "monitor", line=line)
+
+class CLISession(FlashSession):
+    context_class = CLIContext
+
+    def __init__(self, printer):
+        self.printer = printer
+        self.lock = threading.Lock()
+        self.done = 0
+        self.failed = 0
+        super().__init__(State())
+
+    def set_device_state(self, device, state):
+        if self.registry.transition(device, state) and device.context is not None:
+            device.context.status = state
+            self.printer.emit(device.port, "state", state=state, mac=device.mac)
+            with self.lock:
+                if state == DONE:
+                    self.done += 1
+                elif state == FAILED:
+                    self.failed += 1
+            if state in (DONE, FAILED):
+                # wake flash_batch to check the count
+                self.hotplug.notify()
+
+    def finished(self):
+        with self.lock:
+            return self.done + self.failed
+
+    def list_ports(self, profile, backend, allowed=None):
+        ports = backend.list_ports(self.context, profile) if backend.list_ports else []
+        if allowed:
+            ports = [p for p in ports if p in allowed]
+        return ports
+
+    def wait_idle(self, interval=0.1):
+        while self.registry.devices(QUEUED, FLASHING):
+            time.sleep(interval)
+
+def parser():
+    parser = argparse.ArgumentParser(prog="FwFlasher flash", description="Flash devices without the GUI")
+    parser.add_argument("--manifest", default="manifest/manifest.json", help="manifest JSON file or firmware bundle (.fwb)")
+    parser.add_argument("--trusted-key", help="PEM public key bundles must be signed with (default: $FW_FLASHER_TRUSTED_KEY)")
+    parser.add_argument("--profile", help="profile name, defaults to the first one in the manifest")
+    parser.add_argument("--ports", nargs="+", metavar="PORT", help="ports to flash (auto-detected if omitted); with --batch, only these ports are watched")
+    parser.add_argument("--batch", action="store_true", help="keep running and flash every newly plugged device")
+    parser.add_argument("--count", type=int, help="with --batch, exit after this many devices")
+    parser.add_argument("--erase-flash", action="store_true", default=None, help="erase the whole flash first (default from the profile)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="also print tool log lines")
+    return parser
+
+def bundle_parser():
+    parser = argparse.ArgumentParser(prog="FwFlasher bundle", description="Pack a manifest and its files into one firmware bundle")
+    parser.add_argument("--manifest", default="manifest/manifest.json", help="manifest JSON file")
+    parser.add_argument("--output", "-o", help="bundle file, defaults to the manifest name with .fwb")
+    parser.add_argument("--sign-key", help="Ed25519 private key (PEM) to sign the bundle with")
+    return parser
+
+def bundle_main(args):
+    args = bundle_parser().parse_args(args)
+    output = args.output or os.path.splitext(args.manifest)[0] + BUNDLE_SUFFIX
+    try:
+        files, blobs = build_bundle(args.manifest, output, args.sign_key)
+    except (BundleError, OSError) as e:
+        print(e, file=sys.stderr)
+        return EXIT_USAGE
+    print(f"{output}: {files} files, {blobs} distinct, {'signed' if args.sign_key else 'unsigned'}", file=sys.stderr)
+    return EXIT_OK
+
+def interrupt(signum, frame):
+    raise KeyboardInterrupt()
+
+def flash_once(session, profile, backend, ports):
+    if not ports:
+        try:
+            port = backend.determine_port(session.context, profile, "Auto")
+        except IndexError:
+            port = None
+        if not port:
+            session.printer.emit(None, "error", message="Port not found")
+            return
+        ports = [port]
+    session.batch_start()
+    for port in ports:
+        session.batch_enqueue(profile, backend, session.registry.add(port))
+    try:
+        session.wait_idle()
+    finally:
+        session.batch_stop()
+
+def flash_batch(session, profile, backend, allowed, count):
+    session.state.ports = session.list_ports(profile, backend, allowed)
+    session.batch_start()
+    session.printer.emit(None, "batch-start", present=session.state.ports)
+    generation = session.hotplug.generation
+    try:
+        while not count or session.finished() < count:
+            try:
+                session.refresh_plan()
+                session.batch_sync(profile, backend, session.list_ports(profile, backend, allowed))
+            except Exception:
+                import traceback
+                traceback.print_exc()
+            generation = session.hotplug.wait(generation, session.hotplug.interval())
+    except KeyboardInterrupt:
+        pass
+    scheduler = session.scheduler
+    session.batch_stop()
+    # running flashes are cancelled, wait for them to unwind
+    session.wait_idle()
+    if scheduler:
+        print(session.format_batch_stats(scheduler.stats()), file=sys.stderr)
+
+def main(args):
+    args = parser().parse_args(args)
+
+    # keep stdout for the structured lines, tools print freely to stderr
+    out = sys.stdout
+    sys.stdout = sys.stderr
+    printer = Printer(out, args.verbose)
+    session = CLISession(printer)
+    if args.trusted_key:
+        session.trusted_key = args.trusted_key
+    signal.signal(signal.SIGTERM, interrupt)
+
+    try:
+        ok = session.load_profiles(args.manifest)
+    except OSError as e:
+        printer.emit(None, "error", message=str(e))
+        return EXIT_USAGE
+    if not ok:
+        return EXIT_USAGE
+    name = args.profile or session.state.profile
+    profile = session.state.profiles.get(name) if ok else None
+    if not profile:
+        printer.emit(None, "error", message=f"Profile \"{name}\" not found in {args.manifest}")
+        return EXIT_USAGE
+    backend = session.getBackend(profile)
+    if not backend:
+        printer.emit(None, "error", message=session.backend_error(profile))
+        return EXIT_USAGE
+    if session.plan.errors.get(name):
+        # already reported by load_profiles, don't fail every device on it
+        return EXIT_USAGE
+
+    session.state.profile = name
+    session.backend = backend
+    session.state.erase_flash = args.erase_flash if args.erase_flash is not None else profile.get("erase-flash", False)
+    backend.precheck(session.context)
+    session.prepare_images({name: profile}, session.plan)
+
+    try:
+        if args.batch:
+            flash_batch(session, profile, backend, set(args.ports or []), args.count)
+        else:
+            flash_once(session, profile, backend, args.ports)
+    except KeyboardInterrupt:
+        return EXIT_FAILED
+
+    printer.emit(None, "summary", done=session.done, failed=session.failed)
+    if session.failed or not session.done:
+        return EXIT_FAILED
+    return EXIT_OK
@@ -1,44 +1,46 @@
 import sys
 import os
 import re
-import glob
 import serial
-import subprocess
 import json
+import time
+import threading
+import queue
+import functools
+
+from .registry import FLASHING
+from .spawn_loop import spawn_loop
 
 try:
     base_path = sys._MEIPASS
     ARGV0 = [sys.argv[0]]
+    # launcher.py hands "esptool" to esptool_worker before importing anything else
+    ESPTOOL = [sys.argv[0], "esptool"]
 except Exception:
     ARGV0 = [sys.executable, sys.argv[0]]
+    ESPTOOL = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "esptool_worker.py")]
+
+def spawn(command, print_output=True, context=None, **kwargs):
+    # output of every child is read on the shared spawn loop, this thread
+    # only wakes up once per batch of lines
+    batches = queue.SimpleQueue()
+    process = spawn_loop.spawn([str(x) for x in command], batches.put, batches.put, **kwargs)
+    release = context.on_cancel(lambda: spawn_loop.kill(process)) if context else None
 
-def spawn(command, print_output=True, **kwargs):
-    process = subprocess.Popen(
-        command,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        universal_newlines=True,
-        text=True,
-        bufsize=1,
-        **kwargs
-    )
-
-    # Read output line by line and print simultaneously
-    for line in process.stdout:
-        if sys.stdout: # sometimes None on Windows
-            sys.stdout.flush()   # Force immediate output
-        line = line.rstrip("\r\n")
-        if print_output:
-            print(line)
-        yield line
-
-    # Wait for process to complete and get return code
-    return_code = process.wait()
-
-    return return_code
-
-def spawn_gdbmi(command):
-    for line in spawn(command):
+    try:
+        while True:
+            batch = batches.get()
+            if isinstance(batch, int): # return code, after the last batch
+                return batch
+            if print_output and sys.stdout: # sometimes None on Windows
+                print("\n".join(batch), flush=True)
+            yield from batch
+    finally:
+        if release:
+            release()
+
+def spawn_gdbmi(command, context=None):
+    for line in spawn(command, context=context):
         if line:
             if line[0] in "@~&":
                 yield json.loads(line[1:]).rstrip("\r\n")
@@ -49,6 +51,22 @@ def spawn_gdbmi(command):
         else:
             yield ""
 
+def cache_found(func):
+    """
+    Cache a tool lookup once it finds the tool, a miss is retried on the
+    next call so a tool installed while running is picked up
+    """
+    found = []
+    @functools.wraps(func)
+    def lookup():
+        if not found:
+            result = func()
+            if result is None:
+                return None
+            found.append(result)
+        return found[0]
+    return lookup
+
 def strip(s):
     s = re.sub(r'\x1b\[[0-9;]*m', '', s)
     s = re.sub(r'\x1b\[[0-9;]*[a-zA-Z]', '', s)
@@ -62,6 +80,54 @@ def resource_path(relative_path):
 
     return os.path.join(base_path, relative_path)
 
+def parse_usb_id(value):
+    if isinstance(value, str):
+        return int(value, 16)
+    return value
+
+def usb_filter_match(port, filters):
+    """
+    filters: [{"vid": "0x303a", "pid": "0x1001", "serial": "..."}, ...], any entry may match
+    """
+    if not filters:
+        return True
+    for f in filters:
+        if "vid" in f and port.vid != parse_usb_id(f["vid"]):
+            continue
+        if "pid" in f and port.pid != parse_usb_id(f["pid"]):
+            continue
+        if "serial" in f and port.serial_number != f["serial"]:
+            continue
+        return True
+    return False
+
+# USB serial ports as of a hotplug generation, and the ports that passed the
+# open check since; both are dropped when the hotplug generation moves. Without
+# hotplug events ports are listed on every call and the open checks expire
+# every GOOD_PORTS_TTL seconds.
+GOOD_PORTS_TTL = 5
+usb_ports = None
+good_ports = set()
+usb_ports_lock = threading.Lock()
+
+def list_usb_serial_ports(hotplug=None):
+    global usb_ports
+    from serial.tools import list_ports
+    if hotplug and hotplug.available:
+        generation = hotplug.generation
+        with usb_ports_lock:
+            if usb_ports and usb_ports[0] == generation:
+                return usb_ports[1]
+    else:
+        generation = ("poll", int(time.monotonic() // GOOD_PORTS_TTL))
+    # sysfs/IOKit/SetupAPI metadata only, nothing is opened
+    ports = [p for p in list_ports.comports() if p.vid is not None]
+    with usb_ports_lock:
+        if usb_ports and usb_ports[0] != generation:
+            good_ports.clear()
+        usb_ports = (generation, ports)
+    return ports
+
 class Backend():
     show_mac = False
     show_progress = False
@@ -75,28 +141,33 @@ class Backend():
     @staticmethod
     def list_ports(context, profile):
         result = []
-        working_ports = context.main.state.working_ports
+        registry = getattr(context.main, "registry", None)
+        working_ports = registry.ports(FLASHING) if registry else set()
+
+        filters = profile.get("usb-filter", []) if profile else []
+        ports = [p for p in list_usb_serial_ports(getattr(context.main, "hotplug", None)) if usb_filter_match(p, filters)]
 
         if sys.platform.startswith('win'):
-            from serial.tools import list_ports
-            ports = list_ports.comports()
-            ports = [p.name for p in ports if p.vid]
+            ports = [p.name for p in ports]
         elif sys.platform.startswith('linux') or sys.platform.startswith('cygwin'):
-            # this excludes your current terminal "/dev/tty"
-            ports = glob.glob('/dev/tty[A-Za-z]*')
+            ports = [p.device for p in ports]
         elif sys.platform.startswith('darwin'):
-            ports = [p for p in glob.glob('/dev/tty.*') if all([b not in p for b in ["Bluetooth", "debug"]])]
+            ports = [p.device.replace("/dev/cu.", "/dev/tty.") for p in ports]
         else:
             raise EnvironmentError('Unsupported platform')
 
+        with usb_ports_lock:
+            checked = set(good_ports)
         for port in ports:
-            if port in working_ports:
+            if port in working_ports or port in checked:
                 result.append(port)
                 continue
             try:
                 s = serial.Serial(port)
                 s.close()
                 result.append(port)
+                with usb_ports_lock:
+                    good_ports.add(port)
             except (OSError, serial.SerialException):
                 pass
         return result
@@ -105,6 +176,14 @@ class Backend():
     def precheck(context):
         pass
 
+    @staticmethod
+    def batch_start(main, profile):
+        pass
+
+    @staticmethod
+    def batch_stop(main):
+        pass
+
     @staticmethod
     def flash(context, port, profile):
         pass
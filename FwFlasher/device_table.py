@@ -0,0 +1,136 @@
+from PUI.PySide6 import *
+from PySide6 import QtCore, QtWidgets
+
+STATUS_TEXT = {
+    "queued": "Queued",
+    "flashing": "Flashing",
+    "done": "Done",
+    "failed": "Error",
+}
+
+def device_status(context):
+    return STATUS_TEXT.get(context.status, "")
+
+COLUMNS = {
+    "port": ("Port", lambda context: context.port),
+    "mac": ("MAC", lambda context: context.mac),
+    "progress": ("Progress", lambda context: context.progress),
+    "status": ("Status", device_status),
+}
+
+class DeviceTableModel(QtCore.QAbstractTableModel):
+    """
+    Row per batch TaskContext. sync() compares a snapshot of every row and
+    only signals the rows that changed, the view repaints just those cells.
+    """
+    def __init__(self):
+        super().__init__()
+        self.contexts = []
+        self.columns = []
+        self.rows = []
+
+    def snapshot(self, context):
+        return tuple(COLUMNS[column][1](context) for column in self.columns)
+
+    def sync(self, contexts, columns):
+        # TaskContext compares by state, rows are matched by identity
+        known = contexts[:len(self.contexts)]
+        if columns != self.columns or len(known) < len(self.contexts) or any(a is not b for a, b in zip(known, self.contexts)):
+            self.beginResetModel()
+            self.columns = columns
+            self.contexts = contexts
+            self.rows = [self.snapshot(context) for context in contexts]
+            self.endResetModel()
+            return
+
+        if len(contexts) > len(self.contexts):
+            self.beginInsertRows(QtCore.QModelIndex(), len(self.contexts), len(contexts) - 1)
+            self.rows.extend(self.snapshot(context) for context in contexts[len(self.contexts):])
+            self.contexts = contexts
+            self.endInsertRows()
+
+        for i, context in enumerate(self.contexts):
+            row = self.snapshot(context)
+            if row != self.rows[i]:
+                self.rows[i] = row
+                self.dataChanged.emit(self.index(i, 0), self.index(i, len(self.columns) - 1))
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return len(self.rows)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return len(self.columns)
+
+    def data(self, index, role):
+        value = self.rows[index.row()][index.column()]
+        if role == QtCore.Qt.UserRole:
+            return value
+        if role == QtCore.Qt.DisplayRole:
+            if self.columns[index.column()] == "progress":
+                return f"{value:.0f}%"
+            return str(value or "")
+        return None
+
+    def headerData(self, section, orientation, role):
+        if role == QtCore.Qt.DisplayRole and orientation == QtCore.Qt.Horizontal:
+            return COLUMNS[self.columns[section]][0]
+        return None
+
+class ProgressDelegate(QtWidgets.QStyledItemDelegate):
+    def paint(self, painter, option, index):
+        bar = QtWidgets.QStyleOptionProgressBar()
+        bar.rect = option.rect
+        bar.minimum = 0
+        bar.maximum = 100
+        bar.progress = int(index.data(QtCore.Qt.UserRole) or 0)
+        bar.text = f"{bar.progress}%"
+        bar.textVisible = True
+        QtWidgets.QApplication.style().drawControl(QtWidgets.QStyle.CE_ProgressBar, bar, painter)
+
+class DeviceTable(QtBaseWidget):
+    """
+    Batch devices in a QTableView, which only paints the visible rows.
+    frame: read by the caller so the view is rebuilt when any row changed
+    """
+    def __init__(self, contexts, columns, frame=None):
+        super().__init__()
+        self.contexts = list(contexts)
+        self.columns = columns
+
+    def update(self, prev):
+        if prev and prev.ui:
+            self.ui = prev.ui
+            self.qt_model = prev.qt_model
+            self.delegate = prev.delegate
+            self.ui.clicked.disconnect()
+        else:
+            self.qt_model = DeviceTableModel()
+            self.delegate = ProgressDelegate(None)
+            self.ui = QtWidgets.QTableView()
+            self.ui.setModel(self.qt_model)
+            self.ui.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectRows)
+            self.ui.setSelectionMode(QtWidgets.QAbstractItemView.SingleSelection)
+            self.ui.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+            self.ui.verticalHeader().hide()
+            self.delegate.setParent(self.ui)
+
+        columns_changed = self.columns != self.qt_model.columns
+        self.qt_model.sync(self.contexts, self.columns)
+        if columns_changed:
+            header = self.ui.horizontalHeader()
+            for i, column in enumerate(self.columns):
+                if column == "progress":
+                    self.ui.setItemDelegateForColumn(i, self.delegate)
+                    header.setSectionResizeMode(i, QtWidgets.QHeaderView.Stretch)
+                else:
+                    self.ui.setItemDelegateForColumn(i, None)
+                    header.setSectionResizeMode(i, QtWidgets.QHeaderView.ResizeToContents)
+        self.ui.clicked.connect(self.on_clicked)
+
+        super().update(prev)
+
+    def on_clicked(self, index):
+        node = self.get_node()
+        e = PUIEvent()
+        e.value = node.qt_model.contexts[index.row()]
+        node._clicked(e)
@@ -1,11 +1,12 @@
 import glob
 import os
-import time
 import sys
 import shutil
 import re
 from .common import *
+from . import usb_enum
 
+@cache_found
 def find_dfu_util():
     try:
         base_path = sys._MEIPASS
@@ -31,19 +32,22 @@ def find_dfu_util():
                 return os.path.abspath(dfu_util[0])
     return shutil.which("dfu-util")
 
-dfu_util = find_dfu_util()
-
 class DFUBackend(Backend):
     show_progress = True
     erase_flash = None
 
     @staticmethod
     def list_ports(context, profile):
+        dfu_util = find_dfu_util()
+        ports = usb_enum.list_dfu()
+        if ports is not None:
+            return ports
+
         cmd = [
             dfu_util, "-l"
         ]
         # print(" ".join(cmd))
-        # context.logs.append(" ".join(cmd))
+        # context.log(" ".join(cmd))
         ports = []
         for line in spawn(cmd):
             line = strip(line)
@@ -53,31 +57,21 @@ class DFUBackend(Backend):
 
     @staticmethod
     def precheck(context):
+        dfu_util = find_dfu_util()
         if dfu_util:
             print(f"Found {dfu_util}")
         else:
-            context.logs.append("Error: dfu_util not found")
+            context.error("dfu_util not found")
 
     @staticmethod
     def flash(context, port, profile):
+        dfu_util = find_dfu_util()
         if not dfu_util:
             return
 
-        context.logs = []
+        context.logs.clear()
 
-        files = []
         downloads = profile.get('downloads', [])
-        for download in downloads:
-            files.append(download['download'])
-
-        for file in files:
-            if os.path.isabs(file):
-                pass
-            else:
-                file = os.path.join(context.main.state.root, file)
-            if not os.path.exists(file):
-                context.logs.append(f"Error: File not found: {file}")
-                return
 
         if port == "Auto":
             ports = DFUBackend.list_ports(context, profile)
@@ -87,10 +81,10 @@ class DFUBackend(Backend):
                 port = None
 
         if not port:
-            context.logs.append("Error: DFU port not found")
+            context.error("DFU port not found")
             return
 
-        context.ok = False
+        context.report_result(False)
 
         device_path = re.search(r'path="([^"]+)"', port)
         print("device_path", device_path)
@@ -106,11 +100,7 @@ class DFUBackend(Backend):
             if dfuse_address:
                 args.extend(["--dfuse-address", dfuse_address])
 
-            file = download['download']
-            if os.path.isabs(file):
-                pass
-            else:
-                file = os.path.join(context.main.state.root, file)
+            file = context.main.plan.path(download['download'])
 
             args.extend(["--download", file])
 
@@ -123,38 +113,38 @@ class DFUBackend(Backend):
 
             tasks.append(args)
 
-        has_progress = False
-
-        for task in tasks:
-            cmd = [
-                dfu_util,
-                "-p", device_path,
-                *task
-            ]
-
-            print(" ".join(cmd))
-            context.logs.append(" ".join(cmd))
-            has_erase_phase = False
-            for line in spawn(cmd):
-                line = strip(line)
-                if not line:
-                    continue
-                m = re.search(r'\s*(\S*)\s*\[[ =]*\] *(\d+)%', line)
-                if m:
-                    phase = m.group(1)
-                    progress = int(m.group(2))
-                    if phase == "Erase":
-                        has_erase_phase = True
-                        progress *= 0.5
-                    elif phase == "Download":
-                        if has_erase_phase:
+        with context.stage("write"):
+            has_progress = False
+
+            for task in tasks:
+                cmd = [
+                    dfu_util,
+                    "-p", device_path,
+                    *task
+                ]
+
+                print(" ".join(cmd))
+                context.log(" ".join(cmd))
+                has_erase_phase = False
+                for line in spawn(cmd, context=context):
+                    line = strip(line)
+                    if not line:
+                        continue
+                    m = re.search(r'\s*(\S*)\s*\[[ =]*\] *(\d+)%', line)
+                    if m:
+                        phase = m.group(1)
+                        progress = int(m.group(2))
+                        if phase == "Erase":
+                            has_erase_phase = True
                             progress *= 0.5
-                            progress += 50
-                    context.progress = progress
-                    has_progress = True
-                    continue
-                context.logs.append(line)
-
-        if has_progress:
-            context.ok = True
-            context.done = True
\ No newline at end of file
+                        elif phase == "Download":
+                            if has_erase_phase:
+                                progress *= 0.5
+                                progress += 50
+                        context.report_progress(progress, 100)
+                        has_progress = True
+                        continue
+                    context.log(line)
+
+            if has_progress:
+                context.report_result(True)
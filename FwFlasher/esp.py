@@ -2,12 +2,12 @@ import os
 from threading import Thread
 
 import esptool
-import espefuse
 import espsecure
-import uuid
-import gc
 
 from .common import *
+from . import esp_engine
+from .key_pipeline import KeyBundle, KeyPipeline, DEFAULT_PIPELINE_DEPTH
+from .esptool_pool import EsptoolPool
 
 class ESPBackend(Backend):
     show_mac = True
@@ -15,12 +15,21 @@ class ESPBackend(Backend):
     erase_flash = True
 
     @staticmethod
-    def exec_in_thread(func, args):
-        def wrapper(func, args):
-            func(args)
-        t = Thread(target=wrapper, args=(func, args), daemon=True)
-        t.start()
-        t.join()
+    def exec_in_thread(func, args, **kwargs):
+        esp_engine.run_in_thread(func, args, **kwargs)
+
+    @staticmethod
+    def encrypt_flash_data(keyfile, offset, file, output):
+        ESPBackend.exec_in_thread(espsecure.main, [
+            "encrypt-flash-data",
+            "--aes-xts",
+            "--keyfile", keyfile,
+            "--address", offset,
+            "--output", output,
+            file
+        ])
+        if not os.path.exists(output):
+            raise Exception(f"espsecure encrypt-flash-data failed for {file}")
 
     @staticmethod
     def determine_port(context, profile, port):
@@ -28,14 +37,257 @@ class ESPBackend(Backend):
             port = ESPBackend.list_ports(context, profile)[0]
         return port
 
+    @staticmethod
+    def select_baudrate(context, session, profile, no_stub):
+        ladder = profile.get("baudrate-ladder")
+        if not ladder and profile.get("baudrate") == "auto":
+            ladder = esp_engine.DEFAULT_BAUD_LADDER
+        if not ladder:
+            return int(profile.get("baudrate", 460800))
+        # each rate reconnects, so the walk counts against the connect timeout
+        with context.stage("connect"):
+            rate = session.negotiate_baud(ladder, stub=not no_stub, flash_size=profile.get("flash-size", "4MB"))
+        context.log(f"Baud rate: {rate}")
+        return rate
+
+    @staticmethod
+    def skip_unchanged(context, session, profile, parts, file_sizes):
+        """
+        Drop parts whose flash region already holds the same bytes
+        """
+        flash_mode = profile.get("flash-mode", "dio")
+        flash_size = profile.get("flash-size", "4MB")
+        flash_freq = profile.get("flash-freq", "80m")
+        esp = session.loader(stub=not profile.get("no-stub", False), baud=session.baud)
+        if esp.secure_download_mode:
+            return parts, file_sizes
+        session.attach_flash(flash_size)
+
+        changed_parts = []
+        changed_sizes = []
+        for (offset, file), size in zip(parts, file_sizes):
+            image = context.main.image_cache.get(profile.get("type"), int(offset, 0), file, flash_mode, flash_size, flash_freq)
+            if image and session.flash_md5(image.address, len(image.image)) == image.md5:
+                context.log(f"Skip {offset} {os.path.basename(file)}: unchanged")
+                continue
+            changed_parts.append((offset, file))
+            changed_sizes.append(size)
+        return changed_parts, changed_sizes
+
+    @staticmethod
+    def flash_subprocess(context, session, profile, parts, file_sizes, progress_map, erase_all, auto_flash_encryption):
+        port = session.port
+        cmd = ["--port", port]
+        cmd.extend(["--chip", profile.get("type")])
+        cmd.extend(["-b", session.baud or profile.get("baudrate", "460800")])
+        cmd.extend([f"--before={profile.get('before', 'default_reset')}"])
+        cmd.extend([f"--after={profile.get('after', 'hard_reset')}"])
+        if profile.get("no-stub", False) or auto_flash_encryption:
+            cmd.extend(["--no-stub"])
+        cmd.extend(["write-flash"])
+        if erase_all:
+            cmd.extend(["--erase-all"])
+            if auto_flash_encryption:
+                cmd.extend(["--force"])
+        cmd.extend(["--flash-mode", profile.get("flash-mode", "dio")])
+        cmd.extend(["--flash-freq", profile.get("flash-freq", "80m")])
+        cmd.extend(["--flash-size", profile.get("flash-size", "4MB")])
+        if auto_flash_encryption:
+            cmd.extend(["--encrypt", "--force"])
+        for offset, file in parts:
+            cmd.extend([offset, file])
+
+        total_size = sum(file_sizes)
+
+        cmd = [str(x) for x in cmd]
+        pool = context.main.esptool_pool
+        if not pool:
+            cmd = [*ESPTOOL, *cmd]
+        context.log("esptool " + " ".join(cmd))
+
+        lines = pool.run(cmd, context=context) if pool else spawn(cmd, context=context)
+        returncode = None
+        def output():
+            nonlocal returncode
+            returncode = yield from lines
+
+        flash_parts_progress = 0
+        try:
+            for line in output():
+                m = re.search(r"Writing at (0x[0-9a-fA-F]+)\s*\[.*?\].*?%\s*(\d+)/(\d+)\s*bytes", line)
+                if m:
+                    offset = int(m.group(1), 0)
+                    if offset in progress_map:
+                        flash_parts_progress = progress_map[offset]
+                    a = int(m.group(2), 0)
+                    context.report_progress(sum(file_sizes[:flash_parts_progress]) + a, total_size)
+                else:
+                    line = re.sub(r"\x1b\[[0-9;]*\w", "", line.strip())
+                    if line:
+                        context.log(line)
+                m = re.search(r"MAC:\s*([0-9a-fA-F:]+)", line)
+                if m:
+                    context.found_mac(m.group(1))
+                if "Error" in line:
+                    context.report_result(False)
+                    context.report_progress(0, 100)
+                    context.log(line)
+                    return False
+
+            if returncode != 0:
+                context.report_result(False)
+                context.report_progress(0, 100)
+                context.error(f"esptool exited with {returncode}")
+                return False
+            context.report_progress(100, 100)
+        except Exception as e:
+            import traceback
+            context.report_result(False)
+            context.report_progress(0, 100)
+            context.error(f"{e}")
+            context.error(traceback.format_exc())
+            traceback.print_exc()
+            return False
+        return True
+
+    @staticmethod
+    def flash_in_process(context, session, profile, parts, file_sizes, erase_all, auto_flash_encryption):
+        total_size = sum(file_sizes)
+
+        # write_flash() sends the parts sorted by address
+        order = sorted(range(len(parts)), key=lambda i: int(parts[i][0], 0))
+        sizes = [file_sizes[i] for i in order]
+
+        class Listener(esp_engine.FlashListener):
+            def log(self, line):
+                context.log(line)
+
+            def mac(self, mac):
+                context.found_mac(mac)
+
+            def progress(self, part, written, total):
+                if part < len(sizes) and total:
+                    context.report_progress(sum(sizes[:part]) + sizes[part] * written / total, total_size)
+
+        no_stub = profile.get("no-stub", False) or auto_flash_encryption
+        force = auto_flash_encryption
+        context.log(f"esptool write-flash (in-process) {' '.join(f'{o} {os.path.basename(f)}' for o, f in parts)}")
+        try:
+            esp_engine.write_flash(
+                Listener(),
+                session,
+                [(int(parts[i][0], 0), parts[i][1]) for i in order],
+                baud=session.baud,
+                no_stub=no_stub,
+                flash_mode=profile.get("flash-mode", "dio"),
+                flash_freq=profile.get("flash-freq", "80m"),
+                flash_size=profile.get("flash-size", "4MB"),
+                chip=profile.get("type"),
+                image_cache=context.main.image_cache,
+                erase_all=erase_all,
+                encrypt=auto_flash_encryption,
+                force=force,
+            )
+            context.report_progress(100, 100)
+        except Exception as e:
+            import traceback
+            context.report_result(False)
+            context.report_progress(0, 100)
+            context.error(f"{e}")
+            context.error(traceback.format_exc())
+            traceback.print_exc()
+            return False
+        return True
+
+    @staticmethod
+    def resolve_parts(context, profile):
+        parts = []
+        for offset, file in profile.get("write-flash", []):
+            parts.append((offset, context.main.plan.path(file)))
+        return parts
+
+    @staticmethod
+    def batch_start(main, profile):
+        security = profile.get("security", {})
+        if security.get("flash_encryption_key_block") and security.get("flash_encryption_key_purpose") and not security.get("flash_encryption_key"):
+            # random key per device: generate keys and encrypted images ahead of demand
+            main.key_pipeline = KeyPipeline(main.temp_dir, ESPBackend.resolve_parts(main.context, profile), depth=profile.get("key-pipeline-depth", DEFAULT_PIPELINE_DEPTH))
+            main.key_pipeline.profile = profile
+        workers = profile.get("esptool-workers", 0)
+        if workers and not profile.get("in-process", False) and EsptoolPool.available():
+            main.esptool_pool = EsptoolPool(workers)
+
+    @staticmethod
+    def batch_stop(main):
+        pipeline = main.key_pipeline
+        main.key_pipeline = None
+        if pipeline:
+            Thread(target=pipeline.close, daemon=True).start()
+        pool = main.esptool_pool
+        main.esptool_pool = None
+        if pool:
+            Thread(target=pool.close, daemon=True).start()
+
+    @staticmethod
+    def take_key_bundle(context, profile):
+        pipeline = context.main.key_pipeline
+        if pipeline and pipeline.profile is profile:
+            return pipeline.get()
+        return KeyBundle.create(context.main.temp_dir, ESPBackend.resolve_parts(context, profile))
+
     @staticmethod
     def flash(context, port, profile):
-        context.logs = []
+        context.logs.clear()
 
         if not port:
-            context.logs.append("Error: Port not found")
+            context.error("Port not found")
             return
 
+        secrets = []
+        session = esp_engine.EspSession(port, before=profile.get("before", "default-reset").replace("_", "-"))
+        release = context.on_cancel(session.cancel)
+        try:
+            ESPBackend.flash_device(context, session, profile, secrets)
+        except Exception as e:
+            import traceback
+            context.report_result(False)
+            context.report_progress(0, 100)
+            context.error(f"{e}")
+            context.error(traceback.format_exc())
+            traceback.print_exc()
+        finally:
+            release()
+            for secret in secrets:
+                secret.wipe()
+            try:
+                session.finish(profile.get("after", "hard-reset").replace("_", "-"))
+            except Exception:
+                session.close()
+
+    @staticmethod
+    def burn_efuses(context, session, port, batch):
+        cmd = ["--port", port, *batch.args()]
+        for line in batch.describe():
+            context.log(f"espefuse {line}")
+        context.log("espefuse " + " ".join(cmd))
+        context.report_result(True)
+        with context.stage("efuse"):
+            try:
+                session.efuse(cmd)
+                context.log("espefuse burn done")
+            except Exception as e:
+                import traceback
+                context.report_result(False)
+                context.report_progress(0, 100)
+                context.error(f"{e}")
+                context.error(traceback.format_exc())
+                traceback.print_exc()
+        return context.ok
+
+    @staticmethod
+    def flash_device(context, session, profile, secrets):
+        port = session.port
+
         security = profile.get("security", {})
 
         secure_boot_digest = security.get("secure_boot_digest", "")
@@ -55,60 +307,46 @@ class ESPBackend(Backend):
 
         if any(secure_boot_settings):
             if secure_boot_digest:
-                if not os.path.isabs(secure_boot_digest):
-                    secure_boot_digest = os.path.join(context.main.manifest_dir, secure_boot_digest)
-                if not os.path.exists(secure_boot_digest):
-                    context.logs.append(f"Error: Secure boot digest file not found: {secure_boot_digest}")
-                    return
+                secure_boot_digest = context.main.plan.path(secure_boot_digest)
             else:
-                context.logs.append(f"Error: Secure boot digest is not set")
+                context.error(f"Secure boot digest is not set")
                 return
 
-        loader = esptool.cmds.detect_chip(port)
-        secinfo = loader.get_security_info()
+        with context.stage("connect"):
+            secinfo = session.get_security_info()
         initial_flash_encryption_enabled = bool(secinfo["flash_crypt_cnt"] & 1)
         initial_secure_boot_enabled = secinfo["parsed_flags"]["SECURE_BOOT_EN"]
-        secinfo = None
-        loader = None
-        gc.collect()
 
-        context.logs.append("Security status:")
-        context.logs.append(f"Flash encryption: {initial_flash_encryption_enabled}")
-        context.logs.append(f"Secure Boot: {initial_secure_boot_enabled}")
+        context.log("Security status:")
+        context.log(f"Flash encryption: {initial_flash_encryption_enabled}")
+        context.log(f"Secure Boot: {initial_secure_boot_enabled}")
 
         if any(flash_encryption_settings):
             if flash_encryption_key:
-                if not os.path.isabs(flash_encryption_key):
-                    flash_encryption_key = os.path.join(context.main.manifest_dir, flash_encryption_key)
-                if not os.path.exists(flash_encryption_key):
-                    context.logs.append(f"Error: Secure boot digest file not found: {flash_encryption_key}")
-                    return
+                flash_encryption_key = context.main.plan.path(flash_encryption_key)
             elif flash_encryption_key == "":
                 if not initial_flash_encryption_enabled:
-                    flash_encryption_key = os.path.join(context.main.temp_dir, uuid.uuid4().hex)
-                    cmd = [
-                        "generate-flash-encryption-key",
-                        flash_encryption_key
-                    ]
-                    context.logs.append("espsecure " + " ".join(cmd))
+                    context.log("espsecure generate-flash-encryption-key")
                     flash_encryption_key_generated = True
                     try:
-                        ESPBackend.exec_in_thread(espsecure.main, cmd)
-                        context.logs.append("espsecure generate-flash-encryption-key done")
+                        key_bundle = ESPBackend.take_key_bundle(context, profile)
+                        secrets.append(key_bundle)
+                        flash_encryption_key = key_bundle.keyfile
+                        context.log("espsecure generate-flash-encryption-key done")
                     except Exception as e:
                         import traceback
-                        context.ok = False
-                        context.progress = 0
-                        context.logs.append(f"Error: {e}")
-                        context.logs.append(f"Error: {traceback.format_exc()}")
+                        context.report_result(False)
+                        context.report_progress(0, 100)
+                        context.error(f"{e}")
+                        context.error(traceback.format_exc())
                         traceback.print_exc()
                         return
             else:
-                context.logs.append(f"Error: Flash encryption key is not set")
+                context.error(f"Flash encryption key is not set")
                 return
 
         if profile.get("type") == "esp32c2":
-            context.logs.append(f"Error: eFuse combination for ESP32-C2 is not implemented")
+            context.error(f"eFuse combination for ESP32-C2 is not implemented")
             return
 
         # refresh
@@ -118,223 +356,111 @@ class ESPBackend(Backend):
         manual_flash_encryption = False
         auto_flash_encryption = False
         flash_erased = False
+        security_batch = esp_engine.EfuseBatch()
 
         if any(flash_encryption_settings) and initial_flash_encryption_enabled:
             auto_flash_encryption = True
 
         if all(flash_encryption_settings) and not initial_flash_encryption_enabled:
             manual_flash_encryption = True
-            try:
-                loader = esptool.cmds.detect_chip(port)
-                esptool.cmds.erase_flash(loader)
-                flash_erased = True
-            except:
-                pass
-            loader = None
-            gc.collect()
-            print("esptool erase-flash done")
-
-            cmd = [
-                "--port", port,
-                "--do-not-confirm",
-                "burn-key", flash_encryption_key_block, flash_encryption_key, flash_encryption_key_purpose
-            ]
-            context.logs.append("espefuse " + " ".join(cmd))
-            context.ok = True
-            try:
-                ESPBackend.exec_in_thread(espefuse.main, cmd)
-                context.logs.append("espefuse burn-key for flash_encryption_key done")
-            except Exception as e:
-                import traceback
-                context.ok = False
-                context.progress = 0
-                context.logs.append(f"Error: {e}")
-                context.logs.append(f"Error: {traceback.format_exc()}")
-                traceback.print_exc()
-                return
+            with context.stage("erase"):
+                try:
+                    session.erase_flash()
+                    flash_erased = True
+                except Exception:
+                    import traceback
+                    traceback.print_exc()
+            context.log("esptool erase-flash done")
 
-            cmd = [
-                "--port", port,
-                "--do-not-confirm",
-                "burn-efuse",
-                "SPI_BOOT_CRYPT_CNT", "7"
-            ]
-            context.logs.append("espefuse " + " ".join(cmd))
-            context.ok = True
-            try:
-                ESPBackend.exec_in_thread(espefuse.main, cmd)
-                context.logs.append("espefuse burn-efuse for flash_encryption_key done")
-            except Exception as e:
-                import traceback
-                context.ok = False
-                context.progress = 0
-                context.logs.append(f"Error: {e}")
-                context.logs.append(f"Error: {traceback.format_exc()}")
-                traceback.print_exc()
+            security_batch.burn_key(flash_encryption_key_block, flash_encryption_key, flash_encryption_key_purpose)
+            security_batch.burn_efuse("SPI_BOOT_CRYPT_CNT", "7")
 
         if all(secure_boot_settings):
             if not initial_secure_boot_enabled:
-                cmd = [
-                    "--port", port,
-                    "--do-not-confirm",
-                    "burn-key", secure_boot_digest_block, secure_boot_digest, secure_boot_digest_purpose
-                ]
-                context.logs.append("espefuse " + " ".join(cmd))
-                context.ok = True
-                try:
-                    ESPBackend.exec_in_thread(espefuse.main, cmd)
-                    context.logs.append("espefuse burn-key for secure_boot_digest done")
-                except Exception as e:
-                    import traceback
-                    context.ok = False
-                    context.progress = 0
-                    context.logs.append(f"Error: {e}")
-                    context.logs.append(f"Error: {traceback.format_exc()}")
-                    traceback.print_exc()
-                    return
+                security_batch.burn_key(secure_boot_digest_block, secure_boot_digest, secure_boot_digest_purpose)
 
-        context.logs.append("Download encryption status:")
-        context.logs.append(f"Auto encryption: {auto_flash_encryption}")
-        context.logs.append(f"Manual encryption: {manual_flash_encryption}")
+        # keys are burned before the write, as one espefuse transaction
+        if security_batch and not ESPBackend.burn_efuses(context, session, port, security_batch):
+            return
 
-        cmd = [*ARGV0, "esptool"]
-        cmd.extend(["--port", port])
-        cmd.extend(["--chip", profile.get("type")])
-        cmd.extend(["-b", profile.get("baudrate", "460800")])
-        cmd.extend([f"--before={profile.get('before', 'default_reset')}"])
-        cmd.extend([f"--after={profile.get('after', 'hard_reset')}"])
-        if profile.get("no-stub", False) or auto_flash_encryption:
-            cmd.extend(["--no-stub"])
-        cmd.extend(["write-flash"])
-        if context.main.state.erase_flash and profile.get("erase-flash") != "disabled" and not flash_erased and not (initial_secure_boot_enabled and not secure_boot_overwrite_bootloader):
-            cmd.extend(["--erase-all"])
-            if auto_flash_encryption:
-                cmd.extend(["--force"])
-        cmd.extend(["--flash-mode", profile.get("flash-mode", "dio")])
-        cmd.extend(["--flash-freq", profile.get("flash-freq", "80m")])
-        cmd.extend(["--flash-size", profile.get("flash-size", "4MB")])
-        if auto_flash_encryption:
-            cmd.extend(["--encrypt", "--force"])
+        context.log("Download encryption status:")
+        context.log(f"Auto encryption: {auto_flash_encryption}")
+        context.log(f"Manual encryption: {manual_flash_encryption}")
+
+        erase_all = context.main.state.erase_flash and profile.get("erase-flash") != "disabled" and not flash_erased and not (initial_secure_boot_enabled and not secure_boot_overwrite_bootloader)
+
+        parts = []
         progress_map = {}
         flash_parts_num = 0
         file_sizes = []
         for offset, file in profile.get("write-flash", []):
-            if os.path.isabs(file):
-                pass
-            else:
-                file = os.path.join(context.main.state.root, file)
-            if not os.path.exists(file):
-                context.logs.append(f"Error: File not found: {file}")
-                return
+            file = context.main.plan.path(file)
             if manual_flash_encryption:
-                encrypted_file = os.path.join(context.main.temp_dir, uuid.uuid4().hex)
                 try:
-                    ESPBackend.exec_in_thread(espsecure.main, [
-                        "encrypt-flash-data",
-                        "--aes-xts",
-                        "--keyfile", flash_encryption_key,
-                        "--address", offset,
-                        "--output", encrypted_file,
-                        file
-                    ])
-                    # context.logs.append(f"espsecure encrypt-flash-data {file} done")
+                    if flash_encryption_key_generated:
+                        encrypted_file = key_bundle.images[offset]
+                    else:
+                        # fixed key: identical output for every device, encrypt once
+                        encrypted_file = context.main.encrypted_image_cache.get(flash_encryption_key, offset, file, ESPBackend.encrypt_flash_data)
+                    # context.log(f"espsecure encrypt-flash-data {file} done")
                 except Exception as e:
                     import traceback
-                    context.ok = False
-                    context.progress = 0
-                    context.logs.append(f"Error: {e}")
-                    context.logs.append(f"Error: {traceback.format_exc()}")
+                    context.report_result(False)
+                    context.report_progress(0, 100)
+                    context.error(f"{e}")
+                    context.error(traceback.format_exc())
                     traceback.print_exc()
                     return
-                cmd.extend([offset, encrypted_file])
+                parts.append((offset, encrypted_file))
                 file_sizes.append(os.path.getsize(encrypted_file))
                 progress_map[int(offset, 0)] = flash_parts_num
                 flash_parts_num += 1
             else:
                 if auto_flash_encryption and int(offset, 0) < 0x8000 and not secure_boot_overwrite_bootloader:
                     continue
-                cmd.extend([offset, file])
-                file_sizes.append(os.path.getsize(file))
+                parts.append((offset, file))
+                file_sizes.append(context.main.plan.size(file))
                 progress_map[int(offset, 0)] = flash_parts_num
                 flash_parts_num += 1
 
-        total_size = sum(file_sizes)
+        context.report_result(True)
 
-        cmd = [str(x) for x in cmd]
-        print(" ".join(f"\"{x}\"" for x in cmd))
-        # context.logs.append("esptool " + " ".join(cmd))
-        context.ok = True
+        no_stub = profile.get("no-stub", False) or auto_flash_encryption
+        session.baud = ESPBackend.select_baudrate(context, session, profile, no_stub)
 
-        flash_parts_progress = 0
-        try:
-            for line in spawn(cmd):
-                m = re.search(r"Writing at (0x[0-9a-fA-F]+)\s*\[.*?\].*?%\s*(\d+)/(\d+)\s*bytes", line)
-                if m:
-                    offset = int(m.group(1), 0)
-                    if offset in progress_map:
-                        flash_parts_progress = progress_map[offset]
-                    a = int(m.group(2), 0)
-                    b = int(m.group(3), 0)
-                    context.progress = (sum(file_sizes[:flash_parts_progress]) + a) / total_size * 100
-                else:
-                    line = re.sub(r"\x1b\[[0-9;]*\w", "", line.strip())
-                    if line:
-                        context.logs.append(line)
-                m = re.search(r"MAC:\s*([0-9a-fA-F:]+)", line)
-                if m:
-                    context.mac = m.group(1)
-                if "Error" in line:
-                    context.ok = False
-                    context.progress = 0
-                    context.logs.append(line)
-                    return
-
-            if context.ok:
-                context.progress = 100
-        except Exception as e:
-            import traceback
-            context.ok = False
-            context.progress = 0
-            context.logs.append(f"Error: {e}")
-            context.logs.append(f"Error: {traceback.format_exc()}")
-            traceback.print_exc()
-
-        if flash_encryption_key_generated:
-            os.remove(flash_encryption_key)
+        skip_unchanged = profile.get("skip-unchanged", False) and not manual_flash_encryption and not auto_flash_encryption and not erase_all
+        if skip_unchanged:
+            with context.stage("verify"):
+                try:
+                    parts, file_sizes = ESPBackend.skip_unchanged(context, session, profile, parts, file_sizes)
+                    progress_map = {int(offset, 0): i for i, (offset, file) in enumerate(parts)}
+                except esptool.NotImplementedInROMError:
+                    context.log("Flash MD5 not supported, writing all regions")
+
+        with context.stage("write"):
+            if skip_unchanged and not parts:
+                context.log("All regions unchanged")
+                context.report_progress(100, 100)
+                ok = True
+            elif profile.get("in-process", False):
+                ok = ESPBackend.flash_in_process(context, session, profile, parts, file_sizes, erase_all, auto_flash_encryption)
+            else:
+                # hand the port over to the esptool child, efuse stages reconnect afterwards
+                session.close()
+                ok = ESPBackend.flash_subprocess(context, session, profile, parts, file_sizes, progress_map, erase_all, auto_flash_encryption)
+        if not ok:
+            return
 
+        efuse_batch = esp_engine.EfuseBatch()
         efuse = profile.get("efuse", [])
         if efuse:
-            cmd = [
-                "--port", port,
-                "--do-not-confirm",
-                "burn-efuse"
-            ]
+            context.log(f"EFUSE: {efuse}")
             for key, value in efuse:
-                cmd.append(key)
-                cmd.append(value)
-            context.logs.append(f"EFUSE: {efuse}")
-            context.logs.append("espefuse " + " ".join(cmd))
-            context.ok = True
-            try:
-                ESPBackend.exec_in_thread(espefuse.main, cmd)
-                context.logs.append("espefuse burn-efuse done")
-            except Exception as e:
-                import traceback
-                context.ok = False
-                context.progress = 0
-                context.logs.append(f"Error: {e}")
-                context.logs.append(f"Error: {traceback.format_exc()}")
-                traceback.print_exc()
+                efuse_batch.burn_efuse(key, value)
+
+        for key in profile.get("write-protect-efuse", []):
+            efuse_batch.write_protect_efuse(key)
+
+        if efuse_batch:
+            ESPBackend.burn_efuses(context, session, port, efuse_batch)
 
-        write_protect_efuse = profile.get("write-protect-efuse", [])
-        if write_protect_efuse:
-            cmd = []
-            cmd.extend(["--port", port])
-            cmd.append("--do-not-confirm")
-            cmd.append("write-protect-efuse")
-            for key in write_protect_efuse:
-                cmd.append(key)
-            context.logs.append("espefuse " + " ".join(cmd))
-            ESPBackend.exec_in_thread(espefuse.main, cmd)
-
-        context.done = True
\ No newline at end of file
@@ -0,0 +1,345 @@
+import zlib
+import hashlib
+import threading
+from contextlib import contextmanager
+
+import esptool
+import espefuse
+from esptool.logger import log, EsptoolLogger
+from esptool.loader import DEFAULT_TIMEOUT, ERASE_WRITE_TIMEOUT_PER_MB, timeout_per_mb
+
+from .common import strip
+
+# esptool logs through a process-wide singleton, route its output to the
+# listener registered by the calling thread so concurrent flashes don't mix
+_local = threading.local()
+
+class _ThreadLogger(EsptoolLogger):
+    def print(self, *args, **kwargs):
+        listener = getattr(_local, "listener", None)
+        if listener is None:
+            return super().print(*args, **kwargs)
+        listener._write(kwargs.get("sep", " ").join(str(a) for a in args) + kwargs.get("end", "\n"))
+
+    def progress_bar(self, cur_iter, total_iters, prefix="", suffix="", bar_length=30):
+        listener = getattr(_local, "listener", None)
+        if listener is None:
+            return super().progress_bar(cur_iter, total_iters, prefix, suffix, bar_length)
+        listener._progress(cur_iter, total_iters)
+
+# EsptoolLogger.__new__ always hands back the existing singleton, so
+# set_logger(_ThreadLogger()) would be a no-op; swap the class in place
+log.__class__ = _ThreadLogger
+
+class FlashListener():
+    """
+    Receives typed events from an in-process esptool run
+    """
+    def __init__(self):
+        self._buffer = ""
+        self._part = -1
+
+    def log(self, line):
+        pass
+
+    def mac(self, mac):
+        pass
+
+    def progress(self, part, written, total):
+        pass
+
+    def _write(self, text):
+        self._buffer += text
+        *lines, self._buffer = self._buffer.replace("\r", "\n").split("\n")
+        for line in lines:
+            line = strip(line).strip()
+            if line:
+                self.log(line)
+
+    def _progress(self, cur_iter, total_iters):
+        # write_flash() restarts the bar from 0 for each part, in address order
+        if cur_iter == 0:
+            self._part += 1
+        self.progress(self._part, cur_iter, total_iters)
+
+def format_mac(mac):
+    return ":".join(f"{x:02x}" for x in mac)
+
+@contextmanager
+def listening(listener):
+    _local.listener = listener
+    try:
+        yield listener
+    finally:
+        _local.listener = None
+
+# esp*.main quit current thread without returning, run them in a thread and
+# hand the outcome back to the caller
+def run_in_thread(func, *args, **kwargs):
+    errors = []
+    def wrapper():
+        try:
+            func(*args, **kwargs)
+        except SystemExit as e:
+            if e.code:
+                errors.append(esptool.FatalError(f"{getattr(func, '__module__', func)} exited with status {e.code}"))
+        except BaseException as e:
+            errors.append(e)
+    t = threading.Thread(target=wrapper, daemon=True)
+    t.start()
+    t.join()
+    if errors:
+        raise errors[0]
+
+DEFAULT_BAUD_LADDER = [2000000, 1500000, 921600, 460800, 230400, 115200]
+BAUD_VERIFY_SIZE = 0x4000
+
+class BaudRateMemory():
+    """
+    Fastest verified baud rate per USB device, so later flashes on the same
+    port start at the rate that worked
+    """
+    def __init__(self):
+        self.rates = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def identity(port):
+        try:
+            from serial.tools import list_ports
+            for p in list_ports.comports():
+                if p.device == port:
+                    if p.serial_number:
+                        return f"{p.vid:04x}:{p.pid:04x}:{p.serial_number}"
+                    if p.location:
+                        return p.location
+        except Exception:
+            pass
+        return port
+
+    def get(self, port):
+        with self.lock:
+            return self.rates.get(self.identity(port))
+
+    def set(self, port, rate):
+        with self.lock:
+            self.rates[self.identity(port)] = rate
+
+baud_memory = BaudRateMemory()
+
+def verify_link(esp):
+    # the stub reads flash back over the link, checked against the chip's own MD5
+    expected = esp.flash_md5sum(0, BAUD_VERIFY_SIZE)
+    return hashlib.md5(esp.read_flash(0, BAUD_VERIFY_SIZE)).hexdigest() == expected
+
+class EspSession():
+    """
+    One connection to the chip shared by every stage of a flash: security
+    query, erase, eFuse burns and write. Reconnects only when the port was
+    released or the chip was reset (e.g. by espefuse itself).
+    """
+    def __init__(self, port, before="default-reset"):
+        self.port = port
+        self.before = before
+        self.connects = 0
+        self._esp = None
+        self._attached = None
+        self.baud = None
+        self.cancelled = False
+
+    @property
+    def connected(self):
+        return self._esp is not None and self._esp._port.is_open
+
+    @property
+    def esp(self):
+        if self.cancelled:
+            raise esptool.FatalError("Cancelled")
+        if not self.connected:
+            self._esp = esptool.cmds.detect_chip(self.port, connect_mode=self.before if self.connects == 0 else "default-reset")
+            self.connects += 1
+        return self._esp
+
+    def negotiate_baud(self, ladder, stub=True, flash_size="keep"):
+        """
+        Walk down the ladder from the remembered rate and keep the first one
+        that passes a read-back check. The ROM loader can't read flash back
+        in bulk, so without the stub the ROM rate is used.
+        """
+        if not stub:
+            self.baud = esptool.ESPLoader.ESP_ROM_BAUD
+            return self.baud
+        ladder = sorted((int(rate) for rate in ladder), reverse=True)
+        remembered = baud_memory.get(self.port)
+        if remembered in ladder:
+            ladder = ladder[ladder.index(remembered):]
+        for rate in ladder:
+            try:
+                esp = self.loader(stub=stub, baud=rate)
+                self.attach_flash(flash_size)
+                if esp._port.baudrate == rate and verify_link(esp):
+                    baud_memory.set(self.port, rate)
+                    self.baud = rate
+                    return rate
+            except Exception:
+                if self.cancelled:
+                    raise
+            # a failed rate leaves the link unusable, start over from reset
+            self.close()
+        self.baud = esptool.ESPLoader.ESP_ROM_BAUD
+        return self.baud
+
+    def loader(self, stub=True, baud=None):
+        baud = self.baud or baud
+        esp = self.esp
+        if stub and not esp.IS_STUB:
+            esp = self._esp = esptool.cmds.run_stub(esp)
+        if baud and baud > esp.ESP_ROM_BAUD and esp._port.baudrate != baud:
+            try:
+                esp.change_baud(baud)
+            except esptool.NotImplementedInROMError:
+                pass
+        return esp
+
+    def attach_flash(self, flash_size="keep"):
+        esp = self.esp
+        if self._attached is not esp:
+            esptool.cmds.attach_flash(esp)
+            esptool.cmds._set_flash_parameters(esp, flash_size)
+            self._attached = esp
+        return esp
+
+    def flash_md5(self, address, size):
+        return self.esp.flash_md5sum(address, size)
+
+    def get_security_info(self):
+        return self.esp.get_security_info()
+
+    def erase_flash(self):
+        esptool.cmds.erase_flash(self.esp)
+
+    def efuse(self, args):
+        run_in_thread(espefuse.main, args, esp=self.esp)
+
+    def close(self):
+        if self._esp is not None:
+            self._esp._port.close()
+        self._esp = None
+
+    def cancel(self):
+        """
+        From another thread: close the port so a blocked read fails, and don't reconnect
+        """
+        self.cancelled = True
+        esp = self._esp
+        if esp is not None:
+            esp._port.close()
+
+    def finish(self, after="hard-reset"):
+        if self.connected:
+            esptool.cmds.reset_chip(self._esp, after)
+        self.close()
+
+class EfuseBatch():
+    """
+    Collects eFuse operations so espefuse runs them as one chained call:
+    a single read, one batched burn and one verify
+    """
+    def __init__(self):
+        self.keys = []
+        self.efuses = {}
+        self.write_protect = []
+
+    def __bool__(self):
+        return bool(self.keys or self.efuses or self.write_protect)
+
+    def burn_key(self, block, keyfile, purpose):
+        self.keys.append((block, keyfile, purpose))
+
+    def burn_efuse(self, name, value):
+        self.efuses[name] = str(value)
+
+    def write_protect_efuse(self, name):
+        if name not in self.write_protect:
+            self.write_protect.append(name)
+
+    def describe(self):
+        lines = []
+        for block, keyfile, purpose in self.keys:
+            lines.append(f"burn-key {block} {purpose}")
+        for name, value in self.efuses.items():
+            lines.append(f"burn-efuse {name}={value}")
+        for name in self.write_protect:
+            lines.append(f"write-protect-efuse {name}")
+        return lines
+
+    def args(self):
+        args = ["--do-not-confirm"]
+        if self.keys:
+            args.append("burn-key")
+            for key in self.keys:
+                args.extend(key)
+        if self.efuses:
+            args.append("burn-efuse")
+            for name, value in self.efuses.items():
+                args.extend([name, value])
+        if self.write_protect:
+            args.append("write-protect-efuse")
+            args.extend(self.write_protect)
+        return args
+
+def write_compressed(esp, image, listener):
+    """
+    Same wire protocol as esptool.cmds.write_flash() with compression,
+    but sends an image that was already patched and compressed
+    """
+    compressed = image.compressed
+    listener._progress(0, len(compressed))
+    decompress = zlib.decompressobj()
+    esp.flash_defl_begin(len(image.image), len(compressed), image.address)
+    timeout = DEFAULT_TIMEOUT
+    seq = 0
+    sent = 0
+    while sent < len(compressed):
+        block = compressed[sent:sent + esp.FLASH_WRITE_SIZE]
+        block_timeout = max(DEFAULT_TIMEOUT, timeout_per_mb(ERASE_WRITE_TIMEOUT_PER_MB, len(decompress.decompress(block))))
+        esp.flash_defl_block(block, seq, timeout=timeout)
+        # stub ACKs on receive, then writes while receiving the next block
+        timeout = block_timeout
+        sent += len(block)
+        seq += 1
+        listener._progress(sent, len(compressed))
+    esp.flash_defl_finish(reboot=False, timeout=timeout)
+
+    md5 = esp.flash_md5sum(image.address, len(image.image))
+    if md5 != image.md5:
+        raise esptool.FatalError(f"MD5 of image at {image.address:#x} does not match data in flash")
+    listener.log(f"Wrote {len(image.image)} bytes ({len(compressed)} compressed) at {image.address:#010x}, hash verified")
+
+def write_flash(listener, session, parts, baud=460800, no_stub=False,
+                flash_mode="dio", flash_freq="80m", flash_size="4MB", chip=None, image_cache=None, **kwargs):
+    """
+    parts: list of (offset, file) in address order
+    image_cache: ImageCache to take pre-compressed images from, when the
+        connection allows plain compressed writes
+    kwargs: passed to esptool.cmds.write_flash (erase_all, encrypt, force, ...)
+    """
+    with listening(listener):
+        esp = session.loader(stub=not no_stub, baud=baud)
+        if not esp.secure_download_mode:
+            listener.mac(format_mac(esp.read_mac("BASE_MAC")))
+        session.attach_flash(flash_size)
+
+        images = None
+        if image_cache and esp.IS_STUB and not kwargs.get("encrypt") and not esp.secure_download_mode and (esp.CHIP_NAME == "ESP8266" or not esp.get_secure_boot_enabled()):
+            images = [image_cache.get(chip, offset, file, flash_mode, flash_size, flash_freq) for offset, file in parts]
+            if not all(images):
+                images = None
+
+        if images:
+            if kwargs.get("erase_all"):
+                esptool.cmds.erase_flash(esp, force=kwargs.get("force", False))
+            for image in images:
+                write_compressed(esp, image, listener)
+        else:
+            esptool.cmds.write_flash(esp, parts, flash_freq=flash_freq, flash_mode=flash_mode, flash_size=flash_size, **kwargs)
@@ -0,0 +1,122 @@
+import os
+import json
+import signal
+import threading
+import subprocess
+from collections import deque
+
+from .common import ESPTOOL
+from .esptool_worker import EXIT_MARK
+
+class EsptoolPool():
+    """
+    Keeps `size` idle esptool workers (esptool_worker.py --serve) warm. A job
+    takes an idle worker, which forks a child with esptool already imported,
+    so a flash starts in milliseconds instead of paying for interpreter
+    startup and imports. POSIX only, see available().
+    """
+    def __init__(self, size):
+        self.size = size
+        self.idle = deque()
+        self.lock = threading.Lock()
+        self.closed = False
+        self.fill()
+
+    @staticmethod
+    def available():
+        return hasattr(os, "fork")
+
+    def start_worker(self):
+        env = dict(os.environ, PYTHONUNBUFFERED="1") # stream progress lines as they are printed
+        return subprocess.Popen(
+            [*ESPTOOL, "--serve"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            bufsize=1,
+            env=env,
+            start_new_session=True, # killing the group also kills a running job
+        )
+
+    def fill(self):
+        while True:
+            with self.lock:
+                if self.closed or len(self.idle) >= self.size:
+                    return
+            worker = self.start_worker()
+            with self.lock:
+                if self.closed:
+                    self.kill(worker)
+                    return
+                self.idle.append(worker)
+
+    def acquire(self):
+        with self.lock:
+            while self.idle:
+                worker = self.idle.popleft()
+                if worker.poll() is None:
+                    break
+            else:
+                worker = None
+        # warm up a replacement while this one works
+        threading.Thread(target=self.fill, daemon=True).start()
+        return worker or self.start_worker()
+
+    def release(self, worker):
+        with self.lock:
+            if not self.closed and len(self.idle) < self.size:
+                self.idle.append(worker)
+                return
+        self.stop(worker)
+
+    @staticmethod
+    def stop(worker):
+        try:
+            worker.stdin.close()
+            worker.wait(5)
+        except Exception:
+            EsptoolPool.kill(worker)
+
+    @staticmethod
+    def kill(worker):
+        try:
+            os.killpg(worker.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        worker.wait()
+
+    def run(self, args, print_output=True, context=None):
+        """
+        Run esptool with `args` on a worker, yields output lines like spawn()
+        """
+        worker = self.acquire()
+        finished = False
+        release = context.on_cancel(lambda: self.kill(worker)) if context else None
+        try:
+            worker.stdin.write(json.dumps([str(x) for x in args]) + "\n")
+            worker.stdin.flush()
+            for line in worker.stdout:
+                line = line.rstrip("\r\n")
+                if line.startswith(EXIT_MARK):
+                    finished = True
+                    return int(line.split()[-1])
+                if print_output:
+                    print(line)
+                yield line
+        finally:
+            if release:
+                release()
+            # a job abandoned halfway leaves the worker busy, don't reuse it
+            if finished:
+                self.release(worker)
+            else:
+                self.kill(worker)
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            workers = list(self.idle)
+            self.idle.clear()
+        for worker in workers:
+            self.stop(worker)
@@ -0,0 +1,64 @@
+"""
+Minimal entry point for esptool children. Imports nothing but esptool (no
+GUI, no backends) and has no package-relative imports, so it also runs as a
+plain script:
+
+    esptool_worker.py [esptool args]    one-shot, same as `FwFlasher esptool ...`
+    esptool_worker.py --serve           pre-warmed worker for EsptoolPool
+
+A serving worker reads one JSON list of esptool arguments per line from
+stdin, forks a child that runs it with output on stdout, then writes
+EXIT_MARK and the exit code.
+"""
+
+import os
+import sys
+import json
+
+EXIT_MARK = "\0fw-flasher-exit"
+
+def run(args):
+    import esptool
+    esptool.main(args)
+
+def run_child(esptool, args):
+    code = 0
+    try:
+        esptool.main(args)
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except BaseException:
+        import traceback
+        traceback.print_exc()
+        code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(code)
+
+def serve():
+    import esptool # the reason this worker exists: imported once, inherited by every fork
+    while True:
+        line = sys.stdin.readline()
+        if not line:
+            break
+        try:
+            args = json.loads(line)
+        except ValueError:
+            continue
+        sys.stdout.flush()
+        pid = os.fork()
+        if pid == 0:
+            run_child(esptool, args)
+        _, status = os.waitpid(pid, 0)
+        sys.stdout.write(f"{EXIT_MARK} {os.waitstatus_to_exitcode(status)}\n")
+        sys.stdout.flush()
+
+def main(args):
+    if args[:1] == ["--serve"]:
+        serve()
+    else:
+        run(args)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
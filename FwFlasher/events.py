@@ -0,0 +1,131 @@
+import time
+import threading
+from contextlib import contextmanager
+
+class Event():
+    def __init__(self):
+        self.timestamp = time.time()
+
+    def __repr__(self):
+        fields = ", ".join(f"{k}={v!r}" for k, v in self.__dict__.items() if k != "timestamp")
+        return f"{self.__class__.__name__}({fields})"
+
+class StageStart(Event):
+    def __init__(self, name):
+        super().__init__()
+        self.name = name
+
+class StageEnd(Event):
+    def __init__(self, name, ok, duration):
+        super().__init__()
+        self.name = name
+        self.ok = ok
+        self.duration = duration
+
+class Progress(Event):
+    """
+    written/total are bytes where the tool reports bytes, otherwise any
+    consistent unit (e.g. percent)
+    """
+    def __init__(self, written, total):
+        super().__init__()
+        self.written = written
+        self.total = total
+
+    @property
+    def percent(self):
+        if not self.total:
+            return 0
+        return self.written / self.total * 100
+
+class MacFound(Event):
+    def __init__(self, mac):
+        super().__init__()
+        self.mac = mac
+
+class Error(Event):
+    def __init__(self, message):
+        super().__init__()
+        self.message = message
+
+class Result(Event):
+    """
+    Outcome of the flash so far, a later Result supersedes an earlier one
+    """
+    def __init__(self, ok):
+        super().__init__()
+        self.ok = ok
+
+class LogLine(Event):
+    def __init__(self, line):
+        super().__init__()
+        self.line = line
+
+class EventBus():
+    def __init__(self):
+        self.subscribers = []
+        self.lock = threading.Lock()
+
+    def subscribe(self, callback):
+        with self.lock:
+            self.subscribers = self.subscribers + [callback]
+        return lambda: self.unsubscribe(callback)
+
+    def unsubscribe(self, callback):
+        with self.lock:
+            self.subscribers = [s for s in self.subscribers if s is not callback]
+
+    def publish(self, event):
+        for callback in self.subscribers:
+            try:
+                callback(event)
+            except Exception:
+                import traceback
+                traceback.print_exc()
+
+class TaskEvents():
+    """
+    Reporting API used by backends; expects self.events to be an EventBus
+    """
+    def log(self, line):
+        self.events.publish(LogLine(str(line)))
+
+    def error(self, message):
+        self.events.publish(Error(str(message)))
+
+    def found_mac(self, mac):
+        self.events.publish(MacFound(mac))
+
+    def report_progress(self, written, total):
+        self.events.publish(Progress(written, total))
+
+    def report_result(self, ok):
+        self.events.publish(Result(ok))
+
+    def on_cancel(self, callback):
+        """
+        Run callback (kill a child, close a port) if this flash gets cancelled,
+        returns a function that unregisters it
+        """
+        scope = getattr(self, "cancel_scope", None)
+        if scope is None:
+            return lambda: None
+        token = scope.add(callback)
+        return lambda: scope.remove(token)
+
+    @property
+    def cancelled(self):
+        scope = getattr(self, "cancel_scope", None)
+        return bool(scope and scope.cancelled)
+
+    @contextmanager
+    def stage(self, name):
+        self.events.publish(StageStart(name))
+        start = time.monotonic()
+        ok = False
+        try:
+            yield
+            # backends report most failures through Result events (self.ok) rather than raising
+            ok = getattr(self, "ok", True)
+        finally:
+            self.events.publish(StageEnd(name, ok, time.monotonic() - start))
@@ -0,0 +1,83 @@
+import sys
+import socket
+import threading
+
+NETLINK_KOBJECT_UEVENT = getattr(socket, "NETLINK_KOBJECT_UEVENT", 15)
+UEVENT_GROUPS = 1 | 2 # kernel events, and udev events sent once rules (permissions) are applied
+SUBSYSTEMS = (b"tty", b"usb", b"usbmisc", b"hidraw")
+POLL_INTERVAL = 1 # without events
+EVENT_INTERVAL = 30 # with events, only for manifest changes on disk
+
+def parse_uevent(data):
+    """
+    Kernel: "action@devpath\\0KEY=VALUE\\0...", udev: "libudev\\0<header>KEY=VALUE\\0...".
+    Only KEY=VALUE fields are returned.
+    """
+    event = {}
+    for field in data.split(b"\0"):
+        key, sep, value = field.partition(b"=")
+        if sep and key.isupper():
+            event[key.decode(errors="ignore")] = value
+    return event
+
+class HotplugMonitor():
+    """
+    Counts device add/remove events so port watchers can block until something
+    changes instead of polling. Linux only (netlink uevents); elsewhere, or if
+    the socket can't be opened, wait() simply times out and callers poll.
+    """
+    def __init__(self):
+        self.generation = 0
+        self.cond = threading.Condition()
+        self.available = False
+
+    def start(self):
+        if not sys.platform.startswith("linux"):
+            return False
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+            sock.bind((0, UEVENT_GROUPS))
+        except (OSError, AttributeError):
+            return False
+        threading.Thread(target=self.reader, args=[sock], daemon=True).start()
+        self.available = True
+        return True
+
+    def reader(self, sock):
+        while True:
+            try:
+                data = sock.recv(65536)
+            except OSError:
+                break
+            event = parse_uevent(data)
+            if event.get("ACTION") in (b"add", b"remove", b"bind", b"unbind") and event.get("SUBSYSTEM") in SUBSYSTEMS:
+                self.notify()
+        with self.cond:
+            self.available = False
+            self.cond.notify_all()
+
+    def notify(self):
+        with self.cond:
+            self.generation += 1
+            self.cond.notify_all()
+
+    def interval(self):
+        """
+        Timeout for wait() in port watching loops
+        """
+        return EVENT_INTERVAL if self.available else POLL_INTERVAL
+
+    def wait(self, generation, timeout, settle=0.05):
+        """
+        Block until the generation moves past `generation` or `timeout` expires,
+        returns the current generation
+        """
+        with self.cond:
+            if self.cond.wait_for(lambda: self.generation != generation, timeout):
+                # one plug is a burst of uevents (usb device, interfaces, tty), let it settle
+                while True:
+                    seen = self.generation
+                    self.cond.wait(settle)
+                    if self.generation == seen:
+                        break
+            return self.generation
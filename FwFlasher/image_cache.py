@@ -0,0 +1,174 @@
+import os
+import zlib
+import hashlib
+import threading
+from collections import OrderedDict
+
+class CompressedImage():
+    def __init__(self, address, image, compressed):
+        self.address = address
+        self.image = image # as written to flash, with bootloader header patched
+        self.compressed = compressed
+        self.md5 = hashlib.md5(image).hexdigest()
+
+    @property
+    def size(self):
+        return len(self.image) + len(self.compressed)
+
+digests = {}
+digests_lock = threading.Lock()
+pinned = {} # path -> sha256 from the compiled manifest, trusted without a stat
+
+def pin_digests(plan):
+    global pinned
+    pinned = {path: info.sha256 for path, info in plan.files.items()} if plan else {}
+
+mapped = {} # path -> memoryview of its content in a loaded bundle
+
+def map_sources(sources):
+    global mapped
+    mapped = dict(sources)
+
+def read_file(path):
+    data = mapped.get(path)
+    if data is not None:
+        return bytes(data)
+    with open(path, "rb") as f:
+        return f.read()
+
+def file_digest(path):
+    digest = pinned.get(path)
+    if digest:
+        return digest
+    st = os.stat(path)
+    stamp = (st.st_mtime_ns, st.st_size)
+    with digests_lock:
+        cached = digests.get(path)
+    if cached and cached[0] == stamp:
+        return cached[1]
+    with open(path, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    with digests_lock:
+        digests[path] = (stamp, digest)
+    return digest
+
+class ImageCache():
+    """
+    zlib-compressed flash images shared by all ESP workers, keyed by
+    content hash, chip, flash mode/size/freq and offset
+    """
+    def __init__(self, max_size=256 * 1024 * 1024):
+        self.max_size = max_size
+        self.total_size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.pending = {}
+
+    def get(self, chip, address, file, flash_mode="keep", flash_size="keep", flash_freq="keep"):
+        # esptool is only imported once an ESP profile is used
+        import esptool
+        from esptool.targets import CHIP_DEFS
+        from esptool.util import pad_to
+
+        if chip not in CHIP_DEFS or flash_size in ("detect", "keep"):
+            return None
+        key = (file_digest(file), chip, address, flash_mode, flash_size, flash_freq)
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry:
+                self.entries.move_to_end(key)
+                return entry
+            # only one worker compresses a given image, the others wait for it
+            key_lock = self.pending.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self.lock:
+                entry = self.entries.get(key)
+            if entry:
+                return entry
+
+            image = pad_to(read_file(file), 4)
+            image = esptool.cmds._update_image_flash_params(CHIP_DEFS[chip], address, flash_freq, flash_mode, flash_size, image)
+            entry = CompressedImage(address, image, zlib.compress(image, 9))
+
+            with self.lock:
+                self.pending.pop(key, None)
+                self.entries[key] = entry
+                self.total_size += entry.size
+                while self.total_size > self.max_size and len(self.entries) > 1:
+                    _, evicted = self.entries.popitem(last=False)
+                    self.total_size -= evicted.size
+        return entry
+
+    def prepare(self, profile, plan):
+        chip = profile.get("type", "")
+        for offset, file in profile.get("write-flash", []):
+            file = plan.path(file)
+            if file not in plan.files:
+                continue
+            self.get(chip, int(offset, 0), file,
+                profile.get("flash-mode", "dio"),
+                profile.get("flash-size", "4MB"),
+                profile.get("flash-freq", "80m"),
+            )
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_size = 0
+
+class EncryptedImageCache():
+    """
+    Host-side AES-XTS encrypted images for a fixed flash_encryption_key,
+    stored in temp_dir under a name derived from (key, offset, plaintext)
+    """
+    def __init__(self, temp_dir):
+        self.temp_dir = temp_dir
+        self.files = {}
+        self.lock = threading.Lock()
+        self.pending = {}
+
+    def get(self, keyfile, offset, file, encrypt):
+        """
+        encrypt: callable(keyfile, offset, file, output) producing the encrypted image
+        """
+        key = hashlib.sha256(f"{file_digest(keyfile)}:{int(offset, 0):#x}:{file_digest(file)}".encode()).hexdigest()
+
+        with self.lock:
+            path = self.files.get(key)
+            if path:
+                return path
+            key_lock = self.pending.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self.lock:
+                path = self.files.get(key)
+            if path:
+                return path
+
+            path = os.path.join(self.temp_dir, f"enc_{key}.bin")
+            partial = path + ".part"
+            try:
+                encrypt(keyfile, offset, file, partial)
+                os.replace(partial, path)
+                with self.lock:
+                    self.files[key] = path
+            finally:
+                with self.lock:
+                    self.pending.pop(key, None)
+                try:
+                    os.remove(partial)
+                except OSError:
+                    pass
+        return path
+
+    def clear(self):
+        with self.lock:
+            files = list(self.files.values())
+            self.files.clear()
+        for path in files:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
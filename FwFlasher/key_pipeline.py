@@ -0,0 +1,141 @@
+import os
+import uuid
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import espsecure
+
+FLASH_ENCRYPTION_KEY_LEN = 32 # same as espsecure generate-flash-encryption-key default
+DEFAULT_PIPELINE_DEPTH = 4
+
+def write_secret(path, data):
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+
+def wipe_file(path):
+    try:
+        size = os.path.getsize(path)
+        with open(path, "r+b") as f:
+            f.write(b"\0" * size)
+            f.flush()
+            os.fsync(f.fileno())
+        os.remove(path)
+    except OSError:
+        pass
+
+def zero(key):
+    key[:] = bytes(len(key))
+
+def make_bundle(temp_dir, parts):
+    """
+    Generate a random flash encryption key and encrypt every (offset, file)
+    part with it. Runs in a pool worker, the key file only exists while
+    espsecure needs it. The key is returned as a bytearray for the receiver
+    to wipe; the pickled copy crossing the process boundary can't be.
+    """
+    key = bytearray(os.urandom(FLASH_ENCRYPTION_KEY_LEN))
+    secret_dir = tempfile.mkdtemp(dir=temp_dir)
+    keyfile = os.path.join(secret_dir, "key.bin")
+    images = {}
+    try:
+        write_secret(keyfile, key)
+        for offset, file in parts:
+            output = os.path.join(temp_dir, uuid.uuid4().hex)
+            espsecure.main([
+                "encrypt-flash-data",
+                "--aes-xts",
+                "--keyfile", keyfile,
+                "--address", offset,
+                "--output", output,
+                file
+            ])
+            images[offset] = output
+        return bytearray(key), images
+    except BaseException:
+        for output in images.values():
+            os.remove(output)
+        raise
+    finally:
+        wipe_file(keyfile)
+        os.rmdir(secret_dir)
+        zero(key)
+
+class KeyBundle():
+    """
+    A per-device flash encryption key with its encrypted images, `key` is
+    zeroed once copied. wipe() must be called once the device is done with it.
+    """
+    def __init__(self, temp_dir, key, images):
+        self.key = bytearray(key)
+        zero(key)
+        self.images = images
+        self.secret_dir = tempfile.mkdtemp(dir=temp_dir)
+        self.keyfile = os.path.join(self.secret_dir, "key.bin")
+        write_secret(self.keyfile, self.key)
+
+    @staticmethod
+    def create(temp_dir, parts):
+        key, images = make_bundle(temp_dir, parts)
+        return KeyBundle(temp_dir, key, images)
+
+    def wipe(self):
+        zero(self.key)
+        wipe_file(self.keyfile)
+        try:
+            os.rmdir(self.secret_dir)
+        except OSError:
+            pass
+        for image in self.images.values():
+            try:
+                os.remove(image)
+            except OSError:
+                pass
+        self.images = {}
+
+class KeyPipeline():
+    """
+    Keeps `depth` key bundles in flight on a process pool so batch flashing
+    never waits for key generation and AES-XTS encryption
+    """
+    def __init__(self, temp_dir, parts, depth=DEFAULT_PIPELINE_DEPTH, workers=None):
+        self.temp_dir = temp_dir
+        self.parts = parts
+        self.depth = depth
+        self.lock = threading.Lock()
+        self.futures = deque()
+        self.executor = ProcessPoolExecutor(max_workers=workers or min(depth, os.cpu_count() or 1))
+        self.closed = False
+        with self.lock:
+            self.fill()
+
+    def fill(self):
+        while len(self.futures) < self.depth:
+            self.futures.append(self.executor.submit(make_bundle, self.temp_dir, self.parts))
+
+    def get(self):
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("Key pipeline is closed")
+            future = self.futures.popleft()
+            self.fill()
+        key, images = future.result()
+        return KeyBundle(self.temp_dir, key, images)
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            futures = list(self.futures)
+            self.futures.clear()
+        for future in futures:
+            future.cancel()
+        self.executor.shutdown(wait=True)
+        for future in futures:
+            if future.cancelled() or future.exception():
+                continue
+            key, images = future.result()
+            zero(key)
+            for image in images.values():
+                os.remove(image)
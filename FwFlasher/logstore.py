@@ -0,0 +1,107 @@
+import os
+import tempfile
+import threading
+import itertools
+from collections import deque
+
+DEFAULT_LOG_LINES = 5000
+
+class LogStore():
+    """
+    Bounded, thread-safe line buffer. Keeps the last `cap` lines in memory,
+    older lines go to a spill file in spill_dir (dropped if spill_dir is None).
+    Lines are numbered from 0 so views can render only what is new.
+    """
+    def __init__(self, cap=DEFAULT_LOG_LINES, spill_dir=None, name="log", listener=None):
+        self.cap = cap
+        self.spill_dir = spill_dir
+        self.name = name
+        self.listener = listener
+        self.lock = threading.Lock()
+        self.lines = deque()
+        self.start = 0 # number of the oldest line still in memory
+        self.generation = 0 # bumped by clear(), views rebuild on change
+        self.spill_path = None
+        self.spill_file = None
+
+    @property
+    def end(self):
+        return self.start + len(self.lines)
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __iter__(self):
+        with self.lock:
+            return iter(list(self.lines))
+
+    def append(self, line):
+        self.extend([line])
+
+    def extend(self, lines):
+        with self.lock:
+            self.lines.extend(lines)
+            while len(self.lines) > self.cap:
+                self.spill(self.lines.popleft())
+                self.start += 1
+        if self.listener:
+            self.listener(self)
+
+    def spill(self, line):
+        if not self.spill_dir:
+            return
+        if self.spill_file is None:
+            fd, self.spill_path = tempfile.mkstemp(prefix=f"{self.name}_", suffix=".log", dir=self.spill_dir)
+            self.spill_file = os.fdopen(fd, "w", encoding="utf-8", errors="replace")
+        self.spill_file.write(line + "\n")
+
+    def clear(self):
+        with self.lock:
+            self.lines.clear()
+            self.start = 0
+            self.generation += 1
+            self.remove_spill()
+        if self.listener:
+            self.listener(self)
+
+    def close_spill(self):
+        with self.lock:
+            self.remove_spill()
+
+    def remove_spill(self):
+        # callers hold self.lock
+        if self.spill_file:
+            self.spill_file.close()
+            self.spill_file = None
+        if self.spill_path:
+            try:
+                os.remove(self.spill_path)
+            except OSError:
+                pass
+            self.spill_path = None
+
+    def header(self):
+        with self.lock:
+            if not self.start:
+                return None
+            if self.spill_path:
+                if self.spill_file:
+                    self.spill_file.flush()
+                return f"... {self.start} earlier lines in {self.spill_path}"
+            return f"... {self.start} earlier lines dropped"
+
+    def since(self, seq):
+        """
+        Returns (generation, end, lines numbered seq..end-1 still in memory)
+        """
+        with self.lock:
+            skip = max(seq - self.start, 0)
+            return self.generation, self.end, list(itertools.islice(self.lines, skip, None))
+
+    def text(self):
+        with self.lock:
+            lines = list(self.lines)
+            header = self.header()
+        if header:
+            lines.insert(0, header)
+        return "\n".join(lines)
@@ -0,0 +1,54 @@
+from PUI.PySide6 import *
+from PySide6 import QtWidgets
+
+class LogView(QtBaseWidget):
+    """
+    Read-only view of a LogStore, appends only the lines added since the
+    last render and follows the tail while scrolled to the bottom.
+    version: read by the caller so the view is rebuilt when lines were added,
+    an unchanged version skips asking the store
+    """
+    def __init__(self, store, version=None):
+        super().__init__()
+        self.store = store
+        self.version = version
+        self.generation = None
+        self.seq = 0
+
+    def update(self, prev):
+        if prev and prev.ui:
+            self.ui = prev.ui
+            if prev.store is self.store:
+                self.generation = prev.generation
+                self.seq = prev.seq
+                if self.version is not None and self.version == prev.version:
+                    super().update(prev)
+                    return
+        else:
+            self.ui = QtWidgets.QPlainTextEdit()
+            self.ui.setReadOnly(True)
+            self.ui.setUndoRedoEnabled(False)
+
+        # the widget trims its own oldest blocks, same cap as the store
+        self.ui.setMaximumBlockCount(self.store.cap + 1)
+
+        scrollbar = self.ui.verticalScrollBar()
+        follow = scrollbar.value() >= scrollbar.maximum()
+
+        generation, end, lines = self.store.since(self.seq)
+        if generation != self.generation:
+            generation, end, lines = self.store.since(0)
+            header = self.store.header()
+            if header:
+                lines.insert(0, header)
+            self.ui.setPlainText("\n".join(lines))
+            follow = True
+        elif lines:
+            self.ui.appendPlainText("\n".join(lines))
+        self.generation = generation
+        self.seq = end
+
+        if follow:
+            scrollbar.setValue(scrollbar.maximum())
+
+        super().update(prev)
@@ -0,0 +1,199 @@
+"""
+Manifest compile step: every file a profile refers to is resolved, checked
+and hashed once when the manifest is loaded. Devices then flash from the
+resulting Plan without touching the filesystem.
+"""
+
+import os
+import mmap
+import hashlib
+from types import MappingProxyType
+from concurrent.futures import ThreadPoolExecutor
+
+from . import backends
+
+HASH_WORKERS = min(8, os.cpu_count() or 1)
+
+class FileInfo():
+    def __init__(self, path, size, mtime, sha256):
+        self.path = path
+        self.size = size
+        self.mtime = mtime # st_mtime_ns
+        self.sha256 = sha256
+
+    def __repr__(self):
+        return f"FileInfo({self.path!r}, {self.size}, {self.sha256[:12]})"
+
+def hash_file(path):
+    st = os.stat(path)
+    digest = hashlib.sha256()
+    if st.st_size:
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            # hashlib drops the GIL for big buffers, so files hash in parallel
+            digest.update(m)
+    return FileInfo(path, st.st_size, st.st_mtime_ns, digest.hexdigest())
+
+def openocd_scripts():
+    from .openocd import find_openocd
+    openocd = find_openocd()
+    return os.path.join(openocd[1], "scripts") if openocd else None
+
+def profile_files(kind, profile):
+    """
+    (file, base) pairs a profile refers to, base is None for the manifest
+    directory or a subdirectory of the OpenOCD scripts
+    """
+    files = []
+    if kind == "esp":
+        files.extend((file, None) for offset, file in profile.get("write-flash", []))
+        security = profile.get("security", {})
+        for key in ("secure_boot_digest", "flash_encryption_key"):
+            if security.get(key):
+                files.append((security[key], None))
+    elif kind == "bmp":
+        files.append((profile.get("load", ""), None))
+    elif kind == "openocd":
+        files.append((profile.get("program", ""), None))
+        files.append((profile.get("interface", ""), "interface"))
+        files.append((profile.get("target", ""), "target"))
+    elif kind == "dfu":
+        files.extend((download.get("download", ""), None) for download in profile.get("downloads", []))
+    elif kind == "pyocd":
+        files.extend((cmd[1], None) for cmd in profile.get("commands", []) if len(cmd) > 1)
+    return files
+
+def profile_options(kind, profile):
+    """
+    Errors in backend options that don't depend on files
+    """
+    errors = []
+    if kind == "esp":
+        for entry in profile.get("write-flash", []):
+            try:
+                offset, file = entry
+                int(offset, 0)
+            except (TypeError, ValueError):
+                errors.append(f"Invalid write-flash entry: {entry}")
+        security = profile.get("security", {})
+        if (security.get("secure_boot_digest_block") or security.get("secure_boot_digest_purpose")) and not security.get("secure_boot_digest"):
+            errors.append("Secure boot digest is not set")
+        baudrate = profile.get("baudrate", 460800)
+        if baudrate != "auto":
+            try:
+                int(baudrate)
+            except (TypeError, ValueError):
+                errors.append(f"Invalid baudrate: {baudrate}")
+    elif kind == "bmp":
+        if not profile.get("load"):
+            errors.append("load is not set")
+    elif kind == "openocd":
+        for key in ("program", "interface", "target"):
+            if not profile.get(key):
+                errors.append(f"{key} is not set")
+    elif kind == "dfu":
+        if not profile.get("downloads"):
+            errors.append("downloads is empty")
+        for download in profile.get("downloads", []):
+            if not download.get("download"):
+                errors.append(f"download is not set: {download}")
+    elif kind == "pyocd":
+        if not profile.get("target"):
+            errors.append("target not set")
+        for cmd in profile.get("commands", []):
+            if len(cmd) == 0:
+                errors.append("command is empty")
+            elif cmd[0] not in ("load", "nrf91-update-modem-fw"):
+                errors.append(f"unknown command: {cmd[0]}")
+            elif len(cmd) == 1:
+                errors.append("command is missing file")
+    return errors
+
+class Plan():
+    """
+    Compiled manifest, read-only once built: absolute paths, sizes and
+    sha256 of every referenced file, per-profile errors. A plan goes stale
+    when one of its files changes on disk, see stale().
+    """
+    def __init__(self, root, scripts, files, missing, errors):
+        self.root = root
+        self.scripts = scripts
+        self.files = MappingProxyType(files) # absolute path -> FileInfo
+        self.missing = frozenset(missing)
+        self.errors = MappingProxyType({name: tuple(e) for name, e in errors.items() if e})
+
+    def path(self, file, base=None):
+        if base is not None:
+            if os.path.isabs(file) or not self.scripts:
+                return file
+            return os.path.join(self.scripts, base, file)
+        if os.path.isabs(file):
+            return file
+        return os.path.join(self.root, file)
+
+    def size(self, file):
+        return self.files[self.path(file)].size
+
+    def sha256(self, file):
+        return self.files[self.path(file)].sha256
+
+    def check(self, profile):
+        """
+        Errors for a profile, from the plan alone
+        """
+        kind = backends.backend_kind(profile)
+        if not kind:
+            return [f"Unsupported chip type \"{profile.get('type')}\""]
+        errors = profile_options(kind, profile)
+        for file, base in profile_files(kind, profile):
+            if not file:
+                continue
+            path = self.path(file, base)
+            if path not in self.files and not (base is not None and not self.scripts):
+                errors.append(f"File not found: {path}")
+        return errors
+
+    def stale(self):
+        for info in self.files.values():
+            try:
+                st = os.stat(info.path)
+            except OSError:
+                return True
+            if (st.st_size, st.st_mtime_ns) != (info.size, info.mtime):
+                return True
+        return any(os.path.exists(path) for path in self.missing)
+
+def compile_manifest(profiles, root, previous=None):
+    """
+    Build the Plan for `profiles` with relative paths under `root`. Files
+    unchanged since `previous` keep their hashes.
+    """
+    root = os.path.abspath(root)
+    kinds = {name: backends.backend_kind(profile) for name, profile in profiles.items()}
+    scripts = openocd_scripts() if "openocd" in kinds.values() else None
+    plan = Plan(root, scripts, {}, (), {})
+
+    refs = set()
+    for name, profile in profiles.items():
+        if kinds[name]:
+            refs.update(plan.path(file, base) for file, base in profile_files(kinds[name], profile) if file)
+    refs = {path for path in refs if os.path.isabs(path)} # OpenOCD scripts without OpenOCD can't be resolved
+    paths = sorted(path for path in refs if os.path.isfile(path))
+    missing = refs.difference(paths)
+
+    files = {}
+    todo = []
+    for path in paths:
+        old = previous.files.get(path) if previous else None
+        if old:
+            st = os.stat(path)
+            if (st.st_size, st.st_mtime_ns) == (old.size, old.mtime):
+                files[path] = old
+                continue
+        todo.append(path)
+    with ThreadPoolExecutor(HASH_WORKERS) as pool:
+        for info in pool.map(hash_file, todo):
+            files[info.path] = info
+
+    plan = Plan(root, scripts, files, missing, {})
+    errors = {name: plan.check(profile) for name, profile in profiles.items()}
+    return Plan(root, scripts, files, missing, errors)
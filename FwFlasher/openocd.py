@@ -1,8 +1,11 @@
 import os
+import glob
 import shutil
 
 from .common import *
+from . import usb_enum
 
+@cache_found
 def find_openocd():
     try:
         base_path = sys._MEIPASS
@@ -22,20 +25,20 @@ def find_openocd():
 
     return None
 
-openocd = find_openocd()
-
 class OpenOCDBackend(Backend):
     show_progress = False
 
     @staticmethod
-    def precheck(main):
+    def precheck(context):
+        openocd = find_openocd()
         if openocd:
             print(f"Found {openocd}")
         else:
-            context.logs.append("Error: OpenOCD not found")
+            context.error("OpenOCD not found")
 
     @staticmethod
     def list_ports(context, profile):
+        openocd = find_openocd()
         if not openocd:
             return
 
@@ -43,6 +46,10 @@ class OpenOCDBackend(Backend):
         if not os.path.isabs(interface):
             interface = os.path.join(openocd[1], "scripts", "interface", interface)
 
+        ports = usb_enum.list_probes(usb_enum.probe_kind(interface))
+        if ports is not None:
+            return ports
+
         ports = []
 
         cmd = [
@@ -65,6 +72,7 @@ class OpenOCDBackend(Backend):
 
     @staticmethod
     def erase_flash(context, port, profile):
+        openocd = find_openocd()
         cmd = [
             openocd[0],
             "-f", OpenOCDBackend.get_interface(profile),
@@ -82,17 +90,18 @@ class OpenOCDBackend(Backend):
             "-c", "exit",
         ])
         print(" ".join(cmd))
-        context.logs.append(" ".join(cmd))
-        for line in spawn(cmd):
+        context.log(" ".join(cmd))
+        for line in spawn(cmd, context=context):
             if hasattr(line, "decode"):
                 line = line.decode("utf-8", errors="ignore")
             line = strip(line)
-            context.logs.append(line)
+            context.log(line)
             if "Programming Finished" in line:
-                context.ok = True
+                context.report_result(True)
 
     @staticmethod
     def get_interface(profile):
+        openocd = find_openocd()
         interface = profile.get("interface", "")
         if not os.path.isabs(interface):
             interface = os.path.join(openocd[1], "scripts", "interface", interface)
@@ -100,6 +109,7 @@ class OpenOCDBackend(Backend):
 
     @staticmethod
     def get_target(profile):
+        openocd = find_openocd()
         target = profile.get("target", "")
         if not os.path.isabs(target):
             target = os.path.join(openocd[1], "scripts", "target", target)
@@ -117,35 +127,18 @@ class OpenOCDBackend(Backend):
 
     @staticmethod
     def flash(context, port, profile):
+        openocd = find_openocd()
         if not openocd:
             return
 
-        context.logs = []
-
-        file = profile.get('program', '')
-        if os.path.isabs(file):
-            pass
-        else:
-            file = os.path.join(context.main.state.root, file)
-        if not os.path.exists(file):
-            context.logs.append(f"Error: File not found: {file}")
-            return
+        context.logs.clear()
 
+        file = context.main.plan.path(profile.get('program', ''))
         file = file.replace("\\", "/").replace("\"", "\\\"")
 
-        context.ok = True
+        context.report_result(True)
         interface = OpenOCDBackend.get_interface(profile)
         target = OpenOCDBackend.get_target(profile)
-        if not os.path.exists(interface):
-            context.logs.append(f"Error: Interface file not found: {interface}")
-            context.ok = False
-
-        if not os.path.exists(target):
-            context.logs.append(f"Error: Target file not found: {target}")
-            context.ok = False
-
-        if not context.ok:
-            return
 
         if profile.get("before"):
             cmd = [
@@ -161,15 +154,16 @@ class OpenOCDBackend(Backend):
                 cmd.extend(["-c", c])
             cmd.extend(["-c", "exit"])
             print(" ".join(cmd))
-            context.logs.append(" ".join(cmd))
-            for line in spawn(cmd):
+            context.log(" ".join(cmd))
+            for line in spawn(cmd, context=context):
                 line = strip(line)
-                context.logs.append(line)
+                context.log(line)
 
         if context.main.state.erase_flash:
-            OpenOCDBackend.erase_flash(main, port, profile)
+            with context.stage("erase"):
+                OpenOCDBackend.erase_flash(context, port, profile)
 
-        context.ok = False
+        context.report_result(False)
         cmd = [
             openocd[0],
             "-f", interface,
@@ -192,12 +186,13 @@ class OpenOCDBackend(Backend):
             "-c", f"program \"{file}\" verify reset exit{program_offset}",
         ])
         print(" ".join(cmd))
-        context.logs.append(" ".join(cmd))
-        for line in spawn(cmd):
-            line = strip(line)
-            context.logs.append(line)
-            if "Programming Finished" in line:
-                context.ok = True
+        context.log(" ".join(cmd))
+        with context.stage("write"):
+            for line in spawn(cmd, context=context):
+                line = strip(line)
+                context.log(line)
+                if "Programming Finished" in line:
+                    context.report_result(True)
 
         if profile.get("after"):
             cmd = [
@@ -213,9 +208,8 @@ class OpenOCDBackend(Backend):
                 cmd.extend(["-c", c])
             cmd.extend(["-c", "exit"])
             print(" ".join(cmd))
-            context.logs.append(" ".join(cmd))
-            for line in spawn(cmd):
+            context.log(" ".join(cmd))
+            for line in spawn(cmd, context=context):
                 line = strip(line)
-                context.logs.append(line)
+                context.log(line)
 
-        context.done = True
\ No newline at end of file
@@ -1,5 +1,3 @@
-import os
-import re
 from .common import *
 from pyocd.core.helpers import ConnectHelper
 from pyocd.flash.file_programmer import FileProgrammer
@@ -16,46 +14,35 @@ class PyOCDBackend(Backend):
 
     @staticmethod
     def flash(context, port, profile):
-        context.logs = []
+        context.logs.clear()
 
-        files = []
         commands = profile.get('commands', [])
         target = profile.get('target', None)
         if not target:
-            context.logs.append("Error: target not set")
+            context.error("target not set")
             return
 
         write_cmds_num = 0
         for cmd in commands:
             if len(cmd) == 0:
-                context.logs.append("Error: command is empty")
+                context.error("command is empty")
                 return
             if cmd[0] in ("load", "nrf91-update-modem-fw"):
                 write_cmds_num += 1
                 if len(cmd) == 1:
-                    context.logs.append("Error: command is missing file")
+                    context.error("command is missing file")
                     return
-                files.append(cmd[1])
             else:
-                context.logs.append(f"Error: unknown command: {cmd[0]}")
+                context.error(f"unknown command: {cmd[0]}")
                 return
 
-        for file in files:
-            if os.path.isabs(file):
-                pass
-            else:
-                file = os.path.join(context.main.state.root, file)
-            if not os.path.exists(file):
-                context.logs.append(f"Error: File not found: {file}")
-                return
-
-        context.ok = True
+        context.report_result(True)
 
         options = {}
         frequency = profile.get('frequency', None)
         if frequency:
             options['frequency'] = frequency
-            context.logs.append(f"Frequency: {frequency}")
+            context.log(f"Frequency: {frequency}")
 
         kwargs = {}
         if options:
@@ -63,51 +50,49 @@ class PyOCDBackend(Backend):
         if port != "Auto":
             kwargs["unique_id"] = port
 
-        context.logs.append(f"Starting PyOCD with options: {kwargs}")
+        context.log(f"Starting PyOCD with options: {kwargs}")
 
         with ConnectHelper.session_with_chosen_probe(target_override=target, **kwargs) as session:
+            release = context.on_cancel(session.close)
             target = session.board.target
 
             if context.main.state.erase_flash:
-                context.logs.append("Erasing flash...")
-                target.mass_erase()
-                context.logs.append("Flash erased")
+                with context.stage("erase"):
+                    context.log("Erasing flash...")
+                    target.mass_erase()
+                    context.log("Flash erased")
 
             try:
-                write_cmds_done = 0
-                for cmd in commands:
-                    context.progress = int(write_cmds_done / write_cmds_num * 100)
-
-                    file = cmd[1]
-                    if os.path.isabs(file):
-                        pass
-                    else:
-                        file = os.path.join(context.main.state.root, file)
-
-                    if cmd[0] == "load":
-                        context.logs.append(f"Loading {file}...")
-                        def progress(progress):
-                            print(f"load progress: {progress}")
-                            context.progress = int(write_cmds_done / write_cmds_num * 100) + (progress*100)/write_cmds_num + 1
-                            context.main.wait()
-
-                        programmer = FileProgrammer(session, progress=progress)
-                        programmer.program(file)
-                        write_cmds_done += 1
-
-                    elif cmd[0] == "nrf91-update-modem-fw":
-                        context.logs.append(f"nrf91-update-modem-fw {file}...")
-                        def progress(progress):
-                            print(f"nrf91-update-modem-fw progress: {progress}")
-                            context.progress = int(write_cmds_done / write_cmds_num * 100) + (progress*100)/write_cmds_num + 1
-                            context.main.wait()
-                        update = ModemUpdater(session, progress=progress)
-                        update.program_and_verify(file)
-                        write_cmds_done += 1
-
-                context.progress = 100
-                context.done = True
-            except Exception as e:
+                with context.stage("write"):
+                    write_cmds_done = 0
+                    for cmd in commands:
+                        context.report_progress(write_cmds_done, write_cmds_num)
+
+                        file = context.main.plan.path(cmd[1])
+
+                        if cmd[0] == "load":
+                            context.log(f"Loading {file}...")
+                            def progress(progress):
+                                print(f"load progress: {progress}")
+                                context.report_progress(write_cmds_done + progress, write_cmds_num)
+
+                            programmer = FileProgrammer(session, progress=progress)
+                            programmer.program(file)
+                            write_cmds_done += 1
+
+                        elif cmd[0] == "nrf91-update-modem-fw":
+                            context.log(f"nrf91-update-modem-fw {file}...")
+                            def progress(progress):
+                                print(f"nrf91-update-modem-fw progress: {progress}")
+                                context.report_progress(write_cmds_done + progress, write_cmds_num)
+                            update = ModemUpdater(session, progress=progress)
+                            update.program_and_verify(file)
+                            write_cmds_done += 1
+
+                context.report_progress(100, 100)
+            except Exception:
                 import traceback
-                context.logs.append(traceback.format_exc())
-                context.ok = False
+                context.report_result(False)
+                context.error(traceback.format_exc())
+            finally:
+                release()
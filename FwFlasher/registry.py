@@ -0,0 +1,150 @@
+import re
+import time
+import threading
+
+NEW = "new" # present, not scheduled (e.g. already plugged when the batch started)
+QUEUED = "queued"
+FLASHING = "flashing"
+DONE = "done"
+FAILED = "failed"
+REMOVED = "removed"
+
+TRANSITIONS = {
+    NEW: {QUEUED, FLASHING, REMOVED},
+    QUEUED: {NEW, FLASHING, REMOVED},
+    FLASHING: {DONE, FAILED, REMOVED},
+    DONE: {REMOVED},
+    FAILED: {REMOVED},
+    REMOVED: set(),
+}
+
+def port_order(port):
+    """
+    Sort key, numbers compare by value: /dev/ttyUSB2 before /dev/ttyUSB10
+    """
+    return [(0, int(part), "") if part.isdigit() else (1, 0, part) for part in re.split(r"(\d+)", port)]
+
+class Device():
+    def __init__(self, port, serial=None):
+        self.port = port
+        self.serial = serial
+        self.mac = None
+        self.state = NEW
+        self.context = None
+        self.changed = time.monotonic()
+
+    def __repr__(self):
+        return f"Device({self.port!r}, {self.state})"
+
+class DeviceRegistry():
+    """
+    Devices seen by the port watcher, indexed by port, USB serial and MAC.
+    All access goes through the registry lock; states only move along
+    TRANSITIONS, a removed device is dropped from every index.
+    """
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.by_port = {}
+        self.by_serial = {}
+        self.by_mac = {}
+        self.order = {} # insertion ordered set of live devices
+        self.generation = 0 # bumped when devices are added or removed
+
+    def add(self, port, state=NEW, serial=None, context=None):
+        with self.lock:
+            device = self.by_port.get(port)
+            if device:
+                return device
+            device = Device(port, serial)
+            device.context = context
+            self.by_port[port] = device
+            if serial:
+                self.by_serial[serial] = device
+            self.order[device] = None
+            self.generation += 1
+            if state != NEW:
+                self.transition(device, state)
+            return device
+
+    def get(self, port):
+        with self.lock:
+            return self.by_port.get(port)
+
+    def find_serial(self, serial):
+        with self.lock:
+            return self.by_serial.get(serial)
+
+    def find_mac(self, mac):
+        with self.lock:
+            return self.by_mac.get(mac.lower())
+
+    def set_serial(self, device, serial):
+        with self.lock:
+            if device.serial and self.by_serial.get(device.serial) is device:
+                del self.by_serial[device.serial]
+            device.serial = serial
+            if serial and device.state != REMOVED:
+                self.by_serial[serial] = device
+
+    def set_mac(self, device, mac):
+        with self.lock:
+            if device.mac:
+                self.by_mac.pop(device.mac, None)
+            device.mac = mac.lower() if mac else None
+            if device.mac and device.state != REMOVED:
+                self.by_mac[device.mac] = device
+
+    def transition(self, device, state):
+        """
+        Move a device to `state`, returns False (and changes nothing) when the
+        transition isn't allowed, e.g. a flash finishing after its port was removed
+        """
+        with self.lock:
+            if state not in TRANSITIONS[device.state]:
+                return False
+            device.state = state
+            device.changed = time.monotonic()
+            if state == REMOVED:
+                if self.by_port.get(device.port) is device:
+                    del self.by_port[device.port]
+                if device.serial and self.by_serial.get(device.serial) is device:
+                    del self.by_serial[device.serial]
+                if device.mac and self.by_mac.get(device.mac) is device:
+                    del self.by_mac[device.mac]
+                self.order.pop(device, None)
+                self.generation += 1
+            return True
+
+    def remove(self, port):
+        with self.lock:
+            device = self.by_port.get(port)
+            if device:
+                self.transition(device, REMOVED)
+            return device
+
+    def sync(self, ports):
+        """
+        Reconcile with a port listing: unknown ports are added as NEW, ports
+        that disappeared are removed. Returns (added, removed) devices.
+        """
+        ports = set(ports)
+        with self.lock:
+            removed = [self.remove(port) for port in list(self.by_port) if port not in ports]
+            # plugged-in order is unknown, flash in port order
+            added = [self.add(port) for port in sorted(ports, key=port_order) if port not in self.by_port]
+            return added, removed
+
+    def clear(self):
+        with self.lock:
+            for device in list(self.order):
+                self.transition(device, REMOVED)
+
+    def devices(self, *states):
+        with self.lock:
+            return [d for d in self.order if not states or d.state in states]
+
+    def ports(self, *states):
+        return {d.port for d in self.devices(*states)}
+
+    def contexts(self):
+        return [d.context for d in self.devices() if d.context is not None]
@@ -0,0 +1,233 @@
+import os
+import time
+import threading
+from collections import deque, defaultdict
+
+DEFAULT_BATCH_CONCURRENCY = min(8, os.cpu_count() or 1)
+
+class Job():
+    def __init__(self, key, func, args, group=None):
+        self.key = key
+        self.func = func
+        self.args = args
+        self.group = group # (controller, hub) or None
+        self.queued = time.monotonic()
+        self.started = None
+        self.finished = None
+
+class AdaptiveLimit():
+    """
+    Hill-climbs a group's concurrency on measured throughput, i.e.
+    concurrency / mean job duration at that concurrency
+    """
+    SAMPLES = 6
+
+    def __init__(self, start=2, maximum=DEFAULT_BATCH_CONCURRENCY):
+        self.limit = start
+        self.maximum = max(start, maximum)
+        self.durations = defaultdict(deque)
+
+    def throughput(self, level):
+        durations = self.durations.get(level)
+        if not durations or len(durations) < 3:
+            return None
+        return level / (sum(durations) / len(durations))
+
+    def record(self, level, duration):
+        durations = self.durations[level]
+        durations.append(duration)
+        while len(durations) > self.SAMPLES:
+            durations.popleft()
+
+        current = self.throughput(self.limit)
+        if current is None:
+            return
+        lower = self.throughput(self.limit - 1)
+        higher = self.throughput(self.limit + 1)
+        if lower is not None and lower > current:
+            self.limit -= 1
+        elif self.limit < self.maximum and (higher is None or higher > current):
+            self.limit += 1
+
+class GroupLimits():
+    """
+    Per hub and per host controller concurrency. A limit is an int, "auto"
+    (learned with AdaptiveLimit) or None for unlimited.
+    """
+    def __init__(self, hub=None, controller=None):
+        self.hub = hub
+        self.controller = controller
+        self.maximum = DEFAULT_BATCH_CONCURRENCY # learned limits never exceed the pool size
+        self.adaptive = {}
+
+    def limit(self, kind, name):
+        limit = getattr(self, kind)
+        if limit == "auto":
+            if (kind, name) not in self.adaptive:
+                self.adaptive[(kind, name)] = AdaptiveLimit(maximum=self.maximum)
+            return self.adaptive[(kind, name)].limit
+        return limit
+
+    def record(self, kind, name, level, duration):
+        adaptive = self.adaptive.get((kind, name))
+        if adaptive:
+            adaptive.record(level, duration)
+
+class GroupStats():
+    def __init__(self):
+        self.running = 0
+        self.completed = 0
+        self.busy = 0.0
+        self.first_start = None
+        self.last_finish = None
+
+    def throughput(self):
+        """
+        Completed devices per minute while the group was active
+        """
+        if not self.completed or self.last_finish is None:
+            return 0.0
+        span = self.last_finish - self.first_start
+        return self.completed / span * 60 if span > 0 else 0.0
+
+class BatchScheduler():
+    """
+    Runs batch flash jobs on `concurrency` worker threads, devices beyond
+    that wait in a FIFO queue. Jobs behind the same USB hub or host
+    controller are additionally limited by `limits`; a job whose group is
+    full stays queued while later jobs from other groups start.
+    """
+    def __init__(self, concurrency=DEFAULT_BATCH_CONCURRENCY, limits=None):
+        self.concurrency = max(1, int(concurrency))
+        self.limits = limits or GroupLimits()
+        self.limits.maximum = self.concurrency
+        self.queue = deque()
+        self.cond = threading.Condition()
+        self.running = {}
+        self.stopped = False
+
+        self.submitted = 0
+        self.started = 0
+        self.completed = 0
+        self.max_depth = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.groups = defaultdict(GroupStats) # ("hub"/"controller", name) -> GroupStats
+
+        for i in range(self.concurrency):
+            threading.Thread(target=self.worker, daemon=True).start()
+
+    def submit(self, key, func, *args, group=None):
+        job = Job(key, func, args, group)
+        with self.cond:
+            if self.stopped:
+                return None
+            self.queue.append(job)
+            self.submitted += 1
+            self.max_depth = max(self.max_depth, len(self.queue))
+            self.cond.notify()
+        return job
+
+    def cancel(self, key):
+        """
+        Drop a job that hasn't started yet, returns whether one was dropped
+        """
+        with self.cond:
+            for job in self.queue:
+                if job.key == key:
+                    self.queue.remove(job)
+                    return True
+        return False
+
+    def stop(self):
+        """
+        Stop taking jobs, running ones finish. Returns the dropped pending jobs.
+        """
+        with self.cond:
+            self.stopped = True
+            dropped = list(self.queue)
+            self.queue.clear()
+            self.cond.notify_all()
+        return dropped
+
+    def job_groups(self, job):
+        if not job.group:
+            return []
+        controller, hub = job.group
+        return [("controller", controller), ("hub", hub)]
+
+    def runnable(self, job):
+        for kind, name in self.job_groups(job):
+            limit = self.limits.limit(kind, name)
+            if limit is not None and self.groups[(kind, name)].running >= limit:
+                return False
+        return True
+
+    def next_job(self):
+        for job in self.queue:
+            if self.runnable(job):
+                return job
+        return None
+
+    def worker(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.stopped or self.next_job())
+                job = self.next_job()
+                if job is None:
+                    return
+                self.queue.remove(job)
+                job.started = time.monotonic()
+                self.started += 1
+                wait = job.started - job.queued
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+                self.running[id(job)] = job
+                levels = []
+                for group in self.job_groups(job):
+                    stats = self.groups[group]
+                    stats.running += 1
+                    if stats.first_start is None:
+                        stats.first_start = job.started
+                    levels.append(stats.running)
+            try:
+                job.func(*job.args)
+            except BaseException:
+                import traceback
+                traceback.print_exc()
+            finally:
+                job.finished = time.monotonic()
+                duration = job.finished - job.started
+                with self.cond:
+                    self.running.pop(id(job), None)
+                    self.completed += 1
+                    for (kind, name), level in zip(self.job_groups(job), levels):
+                        stats = self.groups[(kind, name)]
+                        stats.running -= 1
+                        stats.completed += 1
+                        stats.busy += duration
+                        stats.last_finish = job.finished
+                        self.limits.record(kind, name, level, duration)
+                    # a freed group slot may unblock a job further down the queue
+                    self.cond.notify_all()
+
+    def stats(self):
+        with self.cond:
+            started = self.started
+            return {
+                "queued": len(self.queue),
+                "running": len(self.running),
+                "completed": self.completed,
+                "max-depth": self.max_depth,
+                "avg-wait": self.total_wait / started if started else 0.0,
+                "max-wait": self.max_wait,
+                "hubs": {
+                    name: {
+                        "running": stats.running,
+                        "limit": self.limits.limit(kind, name),
+                        "completed": stats.completed,
+                        "per-minute": stats.throughput(),
+                    }
+                    for (kind, name), stats in self.groups.items() if kind == "hub"
+                },
+            }
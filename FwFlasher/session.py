@@ -0,0 +1,326 @@
+import os
+import json
+import tempfile
+import atexit
+import shutil
+from threading import Thread
+from collections import OrderedDict
+
+from . import backends
+from .image_cache import ImageCache, EncryptedImageCache, pin_digests, map_sources
+from .manifest import compile_manifest
+from .bundle import Bundle, BundleError, BUNDLE_SUFFIX
+from .events import *
+from .logstore import DEFAULT_LOG_LINES
+from .hotplug import HotplugMonitor
+from .scheduler import BatchScheduler, GroupLimits, DEFAULT_BATCH_CONCURRENCY
+from . import topology
+from .registry import DeviceRegistry, NEW, QUEUED, FLASHING, DONE, FAILED
+from .cancel import CancelScope, StageTimeouts
+
+CANCEL_GRACE = 5 # seconds a cancelled flash thread gets to unwind before its slot is given back
+
+class FlashSession():
+    """
+    Manifest, caches, device registry and batch scheduling, everything but
+    the widgets; shared by the GUI and the headless CLI. `context_class(main,
+    log_lines)` builds the per-device task contexts.
+    """
+    context_class = None
+
+    def __init__(self, state):
+        self.temp_dir = tempfile.mkdtemp(prefix="fw_flasher_")
+        atexit.register(self.cleanup)
+
+        self.state = state
+        self.state.profile = ""
+        self.state.profiles = {}
+        self.state.root = ""
+        self.state.worker = None
+        self.state.batch_flash = False
+        self.state.erase_flash = False
+        self.state.ports = []
+
+        self.context = self.context_class(self)
+        self.registry = DeviceRegistry()
+
+        self.manifest_dir = None
+        self.plan = None
+        self.bundle = None
+        self.bundle_dir = None
+        self.trusted_key = os.environ.get("FW_FLASHER_TRUSTED_KEY") # PEM public key bundles must be signed with
+        self.backend = None
+        self.image_cache = ImageCache()
+        self.encrypted_image_cache = EncryptedImageCache(self.temp_dir)
+        self.key_pipeline = None
+        self.esptool_pool = None
+        self.scheduler = None
+
+        self.hotplug = HotplugMonitor()
+        self.hotplug.start()
+
+    def cleanup(self):
+        pipeline = self.key_pipeline
+        self.key_pipeline = None
+        if pipeline:
+            pipeline.close()
+        pool = self.esptool_pool
+        self.esptool_pool = None
+        if pool:
+            pool.close()
+        proc = self.context.monitor_proc
+        self.context.monitor_proc = None
+        if proc:
+            proc.terminate()
+        self.context.logs.close_spill()
+        self.context.monitor_logs.close_spill()
+        self.image_cache.clear()
+        self.encrypted_image_cache.clear()
+        self.close_bundle()
+        if os.path.exists(self.temp_dir):
+            shutil.rmtree(self.temp_dir)
+
+    @staticmethod
+    def format_batch_stats(stats):
+        text = f"Running: {stats['running']}, Queued: {stats['queued']} (max {stats['max-depth']}), Done: {stats['completed']}, Wait: avg {stats['avg-wait']:.1f}s / max {stats['max-wait']:.1f}s"
+        for hub, hub_stats in sorted(stats["hubs"].items()):
+            limit = hub_stats["limit"] if hub_stats["limit"] is not None else "-"
+            text += f"\nHub {hub}: {hub_stats['running']}/{limit} running, {hub_stats['completed']} done, {hub_stats['per-minute']:.1f}/min"
+        return text
+
+    def load_profiles(self, file):
+        """
+        Load and compile a manifest or a firmware bundle, profile errors
+        (unsupported type, missing files, bad options) are reported on self.context.
+        Returns whether the manifest could be parsed.
+        """
+        source = file
+        if file.endswith(BUNDLE_SUFFIX):
+            try:
+                file = self.open_bundle(file)
+            except (BundleError, OSError) as e:
+                self.context.error(str(e))
+                return False
+        with open(file, "r") as f:
+            try:
+                profiles = json.load(f, object_pairs_hook=OrderedDict)
+            except Exception:
+                import traceback
+                self.context.error(traceback.format_exc())
+                return False
+        self.state.profiles = profiles
+        if file == source:
+            self.close_bundle()
+        if profiles:
+            self.manifest_dir = os.path.dirname(source)
+            self.state.profile = list(profiles.keys())[0]
+            self.state.root = os.path.abspath(os.path.dirname(file))
+            self.set_plan(compile_manifest(profiles, self.state.root))
+            for name, errors in self.plan.errors.items():
+                for error in errors:
+                    self.context.error(f"{error} in profile \"{name}\"")
+        return True
+
+    def open_bundle(self, file):
+        """
+        Verify a bundle and extract it for the external tools, in-process
+        readers use the mapping directly. Returns the extracted manifest.
+        """
+        bundle = Bundle(file)
+        directory = None
+        try:
+            bundle.verify(self.trusted_key)
+            directory = tempfile.mkdtemp(prefix="bundle_", dir=self.temp_dir)
+            manifest = bundle.extract(directory)
+        except Exception:
+            bundle.close()
+            if directory:
+                shutil.rmtree(directory, ignore_errors=True)
+            raise
+        self.close_bundle()
+        self.bundle = bundle
+        self.bundle_dir = directory
+        map_sources(bundle.sources(directory))
+        return manifest
+
+    def close_bundle(self):
+        bundle = self.bundle
+        self.bundle = None
+        if bundle:
+            map_sources({})
+            bundle.close()
+            shutil.rmtree(self.bundle_dir, ignore_errors=True)
+
+    def set_plan(self, plan):
+        self.plan = plan
+        pin_digests(plan)
+        self.image_cache.clear()
+        self.encrypted_image_cache.clear()
+
+    def refresh_plan(self):
+        """
+        Recompile the manifest if one of its files changed on disk, called from the port watching loops
+        """
+        plan = self.plan
+        if not plan or not plan.stale():
+            return False
+        self.set_plan(compile_manifest(self.state.profiles, plan.root, previous=plan))
+        pipeline = self.key_pipeline
+        self.key_pipeline = None
+        if pipeline:
+            # pre-encrypted images are of the old files
+            Thread(target=pipeline.close, daemon=True).start()
+        self.context.log("Firmware files changed, manifest recompiled")
+        for name, errors in self.plan.errors.items():
+            for error in errors:
+                self.context.error(f"{error} in profile \"{name}\"")
+        return True
+
+    def prepare_images(self, profiles, plan):
+        # compress ESP images once up front instead of on every device
+        for profile in profiles.values():
+            if backends.backend_kind(profile) == "esp" and profile.get("in-process", False):
+                try:
+                    self.image_cache.prepare(profile, plan)
+                except Exception:
+                    import traceback
+                    traceback.print_exc()
+
+    def getBackend(self, profile):
+        if not profile:
+            return None
+        kind = backends.backend_kind(profile)
+        if not kind:
+            print("Unsupported chip type: %s" % profile.get("type"))
+            return None
+        try:
+            return backends.load(kind)
+        except ImportError as e:
+            print(f"Backend {kind} unavailable: {e}")
+            return None
+
+    def backend_error(self, profile):
+        """
+        Why getBackend() returned None for a profile
+        """
+        kind = backends.backend_kind(profile)
+        if not kind:
+            return f"Unsupported chip type \"{profile.get('type')}\""
+        return f"Backend {kind} unavailable: {backends.errors.get(kind)}"
+
+    def batch_start(self):
+        profile = self.state.profiles.get(self.state.profile)
+        if profile is None:
+            return
+        # ports already plugged in are known but not flashed
+        self.registry.clear()
+        self.registry.sync(self.state.ports)
+        backend = self.getBackend(profile)
+        if backend:
+            backend.batch_start(self, profile)
+        limits = GroupLimits(profile.get("batch-hub-concurrency"), profile.get("batch-controller-concurrency"))
+        self.scheduler = BatchScheduler(profile.get("batch-concurrency", DEFAULT_BATCH_CONCURRENCY), limits)
+        self.state.batch_flash = True
+
+    def batch_stop(self):
+        self.state.batch_flash = False
+        scheduler = self.scheduler
+        self.scheduler = None
+        if scheduler:
+            for job in scheduler.stop():
+                context, profile, backend, device = job.args
+                context.log("Batch stopped before flashing")
+                self.set_device_state(device, NEW)
+        for device in self.registry.devices(FLASHING):
+            self.cancel_device(device, "Batch stopped")
+        if self.backend:
+            self.backend.batch_stop(self)
+
+    def batch_sync(self, profile, backend, ports):
+        """
+        Reconcile the registry with a port listing, new ports are queued for flashing
+        """
+        added, removed = self.registry.sync(ports)
+        scheduler = self.scheduler
+        for device in removed:
+            if scheduler:
+                scheduler.cancel(device.port)
+            self.cancel_device(device, "Device unplugged")
+        for device in added:
+            self.batch_enqueue(profile, backend, device)
+
+    def cancel_device(self, device, reason):
+        """
+        Cancel the running flash of a device, if any
+        """
+        scope = getattr(device.context, "cancel_scope", None)
+        if scope and not scope.event.is_set():
+            scope.cancel(reason)
+
+    def set_device_state(self, device, state):
+        if self.registry.transition(device, state) and device.context is not None:
+            device.context.status = state
+
+    def batch_enqueue(self, profile, backend, device):
+        scheduler = self.scheduler
+        if not scheduler:
+            # batch stopped, the device stays NEW
+            return
+        port = device.port
+        context = self.context_class(self, profile.get("log-lines", DEFAULT_LOG_LINES))
+        context.port = port
+        context.events.subscribe(lambda event: isinstance(event, MacFound) and self.registry.set_mac(device, event.mac))
+        self.registry.set_serial(device, topology.usb_serial(port))
+        device.context = context
+        self.set_device_state(device, QUEUED)
+        context.log("Queued")
+        if not scheduler.submit(port, self.batch_worker, context, profile, backend, device, group=topology.locate(port)):
+            context.log("Batch stopped before flashing")
+            self.set_device_state(device, NEW)
+
+    def batch_worker(self, context, profile, backend, device):
+        # runs on a scheduler slot, the flash itself still gets its own thread
+        self.thread_watcher(backend.flash, context, device.port, profile, backend, device)
+
+    # esp*.main quit current thread without returning, so wrap it in a thread for post-return processing
+    def thread_watcher(self, func, context, port, profile, backend, device=None):
+        port = backend.determine_port(context, profile, port)
+        single = device is None
+        if single:
+            self.registry.remove(port)
+            device = self.registry.add(port, context=context)
+        self.set_device_state(device, FLASHING)
+        context.report_result(False)
+
+        scope = context.cancel_scope = CancelScope()
+        timeouts = StageTimeouts(context.events, profile.get("timeouts"), scope)
+        def run():
+            try:
+                errors = self.plan.check(profile) if self.plan else []
+                for error in errors:
+                    context.error(error)
+                if not errors:
+                    func(context, port, profile)
+            finally:
+                scope.finish()
+
+        worker = Thread(target=run, daemon=True)
+        if single:
+            self.state.worker = worker
+        worker.start()
+        scope.event.wait()
+        timeouts.close()
+        if scope.cancelled:
+            # children are killed and ports closed, a thread still stuck after that is abandoned
+            worker.join(CANCEL_GRACE)
+            context.report_result(False)
+            context.error(scope.reason)
+        if context.ok:
+            print("Done")
+            context.log("Done")
+        else:
+            context.log("Error")
+        self.set_device_state(device, DONE if context.ok else FAILED)
+        if single:
+            self.registry.remove(port)
+            self.state.worker = None
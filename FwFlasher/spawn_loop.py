@@ -0,0 +1,100 @@
+import os
+import re
+import sys
+import codecs
+import locale
+import asyncio
+import threading
+
+CHUNK_SIZE = 65536
+NEWLINE = re.compile(r"\r\n|\r|\n")
+
+class LineSplitter():
+    """
+    Incremental decoder + universal newline splitter, same lines as reading
+    a text mode pipe but fed whole chunks at a time
+    """
+    def __init__(self, encoding=None):
+        encoding = encoding or locale.getpreferredencoding(False)
+        self.decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        self.pending = ""
+
+    def feed(self, data, final=False):
+        text = self.pending + self.decoder.decode(data, final)
+        hold = ""
+        if not final and text.endswith("\r"):
+            # may be the first half of a \r\n split across chunks
+            text, hold = text[:-1], "\r"
+        lines = NEWLINE.split(text)
+        self.pending = lines.pop() + hold
+        if final and self.pending:
+            lines.append(self.pending)
+            self.pending = ""
+        return lines
+
+class SpawnLoop():
+    """
+    One asyncio event loop thread that reads the output of every spawned
+    child. Output is read in chunks and handed to on_lines(lines) in
+    batches, on_exit(returncode) is called last; both run on the loop thread.
+    """
+    def __init__(self):
+        self.loop = None
+        self.lock = threading.Lock()
+
+    def ensure_loop(self):
+        with self.lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                if sys.version_info < (3, 12) and hasattr(os, "pidfd_open"):
+                    # the default watcher parks a thread per child, a pidfd is one more fd on
+                    # the loop (the default from 3.12 on)
+                    watcher = asyncio.PidfdChildWatcher()
+                    watcher.attach_loop(self.loop)
+                    asyncio.get_event_loop_policy().set_child_watcher(watcher)
+                threading.Thread(target=self.loop.run_forever, daemon=True).start()
+            return self.loop
+
+    def spawn(self, command, on_lines, on_exit, **kwargs):
+        """
+        Start a child, returns once it is running (or raises like Popen would)
+        """
+        loop = self.ensure_loop()
+        return asyncio.run_coroutine_threadsafe(self.start(command, on_lines, on_exit, kwargs), loop).result()
+
+    async def start(self, command, on_lines, on_exit, kwargs):
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            limit=CHUNK_SIZE,
+            **kwargs
+        )
+        self.loop.create_task(self.pump(process, on_lines, on_exit))
+        return process
+
+    def kill(self, process):
+        """
+        Kill a child started by spawn(), from any thread
+        """
+        def kill():
+            try:
+                process.kill()
+            except ProcessLookupError:
+                pass
+        self.loop.call_soon_threadsafe(kill)
+
+    async def pump(self, process, on_lines, on_exit):
+        splitter = LineSplitter()
+        try:
+            while True:
+                data = await process.stdout.read(CHUNK_SIZE)
+                lines = splitter.feed(data, final=not data)
+                if lines:
+                    on_lines(lines)
+                if not data:
+                    break
+        finally:
+            on_exit(await process.wait())
+
+spawn_loop = SpawnLoop()
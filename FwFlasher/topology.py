@@ -0,0 +1,64 @@
+import re
+
+from . import usb_enum
+
+def split_location(location):
+    """
+    "1-1.2:1.0" (bus-port.port[:config.interface]) -> (controller "1", hub "1-1")
+    """
+    location = location.split(":")[0]
+    bus, sep, ports = location.partition("-")
+    if not sep:
+        return bus, bus
+    if "." in ports:
+        return bus, f"{bus}-{ports.rsplit('.', 1)[0]}"
+    return bus, bus # on the root hub
+
+def find_serial_port(port):
+    try:
+        from serial.tools import list_ports
+        for p in list_ports.comports():
+            if port in (p.device, p.name, "/dev/" + p.name, p.device.replace("/dev/cu.", "/dev/tty.")):
+                return p
+    except Exception:
+        pass
+    return None
+
+def serial_location(port):
+    p = find_serial_port(port)
+    return p.location if p else None
+
+def probe_location(serial):
+    devices = usb_enum.find_devices()
+    if not devices:
+        return None
+    for dev in devices:
+        found = usb_enum.get_string(dev, dev.iSerialNumber)
+        if found and serial in (found, usb_enum.jlink_serial(found)):
+            return usb_enum.usb_path(dev)
+    return None
+
+def usb_serial(port):
+    """
+    USB serial number behind a port, None if unknown
+    """
+    if not port:
+        return None
+    m = re.search(r'serial="([^"]+)"', port)
+    if m:
+        return None if m.group(1) == "UNKNOWN" else m.group(1)
+    p = find_serial_port(port)
+    return p.serial_number if p else None
+
+def locate(port):
+    """
+    (controller, hub) a port sits behind, None if unknown. Handles serial
+    ports, dfu-util port strings and debug probe serial numbers.
+    """
+    if not port:
+        return None
+    m = re.search(r'path="([^"]+)"', port)
+    location = m.group(1) if m else serial_location(port) or probe_location(port)
+    if not location:
+        return None
+    return split_location(location)
@@ -0,0 +1,140 @@
+"""
+In-process USB enumeration with pyusb, so port discovery doesn't spawn
+dfu-util/openocd (and grab the adapter) on every scan. Every function returns
+None when pyusb or a libusb backend is unavailable; callers then fall back to
+the external tool.
+"""
+
+try:
+    import usb.core
+    import usb.util
+except ImportError:
+    usb = None
+
+DFU_CLASS = 0xFE
+DFU_SUBCLASS = 0x01
+DFU_PROTOCOL_DFU_MODE = 0x02
+
+JLINK_VID = 0x1366
+STLINK_VID = 0x0483
+STLINK_PIDS = {
+    0x3744, # V1
+    0x3748, # V2
+    0x374B, 0x3752, # V2-1
+    0x374A, # V2-1 without mass storage
+    0x374D, # V3 loader
+    0x374E, 0x374F, 0x3753, # V3
+    0x3754, 0x3757, # V3 without mass storage
+}
+
+def find_devices():
+    if usb is None:
+        return None
+    try:
+        return list(usb.core.find(find_all=True))
+    except usb.core.NoBackendError:
+        return None
+
+def get_string(dev, index):
+    if not index:
+        return None
+    try:
+        return usb.util.get_string(dev, index)
+    except Exception: # no permission, device gone, stalled request...
+        return None
+
+def usb_path(dev):
+    """
+    Same format as dfu-util's path="" (bus-port.port...)
+    """
+    port_numbers = getattr(dev, "port_numbers", None)
+    if port_numbers:
+        return f"{dev.bus}-{'.'.join(str(p) for p in port_numbers)}"
+    return f"{dev.bus}"
+
+def list_dfu(devices=None):
+    """
+    DFU interfaces in the format of dfu-util -l, after "Found DFU: "
+    """
+    if devices is None:
+        devices = find_devices()
+        if devices is None:
+            return None
+    ports = []
+    for dev in devices:
+        serial = None
+        try:
+            configs = list(dev)
+        except Exception:
+            continue
+        for cfg in configs:
+            for intf in cfg:
+                if intf.bInterfaceClass != DFU_CLASS or intf.bInterfaceSubClass != DFU_SUBCLASS:
+                    continue
+                if serial is None:
+                    serial = get_string(dev, dev.iSerialNumber) or "UNKNOWN"
+                name = get_string(dev, intf.iInterface) or "UNKNOWN"
+                ports.append(
+                    f"[{dev.idVendor:04x}:{dev.idProduct:04x}] ver={dev.bcdDevice:04x}, devnum={dev.address}, "
+                    f"cfg={cfg.bConfigurationValue}, intf={intf.bInterfaceNumber}, path=\"{usb_path(dev)}\", "
+                    f"alt={intf.bAlternateSetting}, name=\"{name}\", serial=\"{serial}\""
+                )
+    return ports
+
+def is_cmsis_dap(dev):
+    # the spec requires "CMSIS-DAP" in the product string
+    product = get_string(dev, dev.iProduct)
+    return bool(product and "CMSIS-DAP" in product)
+
+def is_jlink(dev):
+    return dev.idVendor == JLINK_VID
+
+def is_stlink(dev):
+    return dev.idVendor == STLINK_VID and dev.idProduct in STLINK_PIDS
+
+def jlink_serial(serial):
+    # iSerialNumber is zero padded ("000123456789"), OpenOCD wants the number
+    try:
+        return str(int(serial))
+    except ValueError:
+        return serial
+
+PROBES = {
+    "cmsis-dap": (is_cmsis_dap, lambda serial: serial),
+    "jlink": (is_jlink, jlink_serial),
+    "stlink": (is_stlink, lambda serial: serial),
+}
+
+def probe_kind(interface):
+    """
+    Probe family for an OpenOCD interface script, None if unknown
+    """
+    name = interface.replace("\\", "/").rsplit("/", 1)[-1].lower()
+    if name.startswith("cmsis-dap"):
+        return "cmsis-dap"
+    if name.startswith("jlink"):
+        return "jlink"
+    if name.startswith("stlink") or name.startswith("st-link"):
+        return "stlink"
+    return None
+
+def list_probes(kind, devices=None):
+    """
+    Serial numbers of the attached debug probes of a kind, as OpenOCD's
+    `adapter serial` expects them
+    """
+    if kind not in PROBES:
+        return None
+    if devices is None:
+        devices = find_devices()
+        if devices is None:
+            return None
+    match, to_serial = PROBES[kind]
+    ports = []
+    for dev in devices:
+        if not match(dev):
+            continue
+        serial = get_string(dev, dev.iSerialNumber)
+        if serial:
+            ports.append(to_serial(serial))
+    return ports
@@ -0,0 +1,63 @@
+"""
+Startup time of the headless code paths, each measured in a fresh interpreter.
+
+    python benchmark-startup.py [-n RUNS]
+
+"all backends" imports every backend up front, like before backends were
+loaded lazily; compare it with the single-backend rows.
+"""
+
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+HEAVY = ["esptool", "espefuse", "espsecure", "pyocd", "PySide6"]
+
+SNIPPET = """
+import sys, time, json
+start = time.perf_counter()
+error = None
+try:
+    {code}
+except ImportError as e:
+    error = str(e)
+elapsed = time.perf_counter() - start
+print(json.dumps({{"elapsed": elapsed, "error": error, "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+CASES = {
+    "package": "import FwFlasher",
+    "session": "from FwFlasher.cli import CLISession",
+    "backend esp": "from FwFlasher import backends; backends.load('esp')",
+    "backend dfu": "from FwFlasher import backends; backends.load('dfu')",
+    "backend openocd": "from FwFlasher import backends; backends.load('openocd'); from FwFlasher.openocd import find_openocd; find_openocd()",
+    "backend pyocd": "from FwFlasher import backends; backends.load('pyocd')",
+    # skips pyOCD when it isn't installed, so the row is still comparable
+    "all backends": "import importlib.util; from FwFlasher import backends; [backends.load(k) for k in backends.BACKENDS if k != 'pyocd' or importlib.util.find_spec('pyocd')]",
+}
+
+def measure(code, runs):
+    times = []
+    result = None
+    for i in range(runs):
+        out = subprocess.run([sys.executable, "-c", SNIPPET.format(code=code, heavy=HEAVY)], capture_output=True, text=True, check=True)
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        times.append(result["elapsed"])
+    return statistics.median(times), result
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    for name, code in CASES.items():
+        elapsed, result = measure(code, args.runs)
+        if result["error"]:
+            print(f"{name:16} unavailable ({result['error']})")
+        else:
+            print(f"{name:16} {elapsed * 1000:8.1f} ms  loaded: {', '.join(result['loaded']) or '-'}")
+
+if __name__ == "__main__":
+    main()
@@ -12,6 +12,7 @@ import espefuse
 from FwFlasher.bmp import find_arm_none_eabi_gdb
 from FwFlasher.openocd import find_openocd
 from FwFlasher.dfu import find_dfu_util
+from FwFlasher.backends import BACKENDS
 
 
 # macOS
@@ -38,6 +39,9 @@ else:
     pyinstaller_args.extend(["-i", 'resources/icon.ico'])
 
 pyinstaller_args.extend(["--collect-data", "esptool"])
+# backends are imported by name at runtime
+for module, _ in BACKENDS.values():
+    pyinstaller_args.extend(["--hidden-import", f"FwFlasher.{module}"])
 pyinstaller_args.extend(["--add-binary", espefuse_defs + ":espefuse/efuse_defs"])
 pyinstaller_args.extend(["--add-binary", esptool_targets_stub_flasher + ":esptool/targets/stub_flasher"])
 
@@ -1,4 +1,15 @@
 import sys
-import FwFlasher
 
-FwFlasher.main(sys.argv[1:])
\ No newline at end of file
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["esptool"]:
+        # esptool children of the frozen build, skip the GUI and the backends
+        from FwFlasher import esptool_worker
+        esptool_worker.main(sys.argv[2:])
+    else:
+        import multiprocessing
+
+        # process pool workers re-enter the frozen executable
+        multiprocessing.freeze_support()
+
+        import FwFlasher
+        FwFlasher.main(sys.argv[1:])
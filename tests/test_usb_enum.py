@@ -0,0 +1,130 @@
+import unittest
+from unittest import mock
+
+from FwFlasher import usb_enum
+
+class FakeInterface():
+    def __init__(self, number, alt, cls, subclass, iInterface=0):
+        self.bInterfaceNumber = number
+        self.bAlternateSetting = alt
+        self.bInterfaceClass = cls
+        self.bInterfaceSubClass = subclass
+        self.iInterface = iInterface
+
+class FakeConfig():
+    def __init__(self, value, interfaces):
+        self.bConfigurationValue = value
+        self.interfaces = interfaces
+
+    def __iter__(self):
+        return iter(self.interfaces)
+
+class FakeDevice():
+    """
+    Just the descriptor fields usb_enum reads, strings by descriptor index
+    """
+    def __init__(self, vid, pid, bus=1, port_numbers=(1,), address=1, bcdDevice=0x0100, serial=None, product=None, configs=(), strings=None):
+        self.idVendor = vid
+        self.idProduct = pid
+        self.bus = bus
+        self.port_numbers = port_numbers
+        self.address = address
+        self.bcdDevice = bcdDevice
+        self.strings = dict(strings or {})
+        self.iSerialNumber = 0
+        self.iProduct = 0
+        if serial is not None:
+            self.iSerialNumber = 3
+            self.strings[3] = serial
+        if product is not None:
+            self.iProduct = 2
+            self.strings[2] = product
+        self.configs = list(configs)
+
+    def __iter__(self):
+        return iter(self.configs)
+
+def fake_get_string(dev, index):
+    if not index:
+        return None
+    return dev.strings.get(index)
+
+class ListDfuTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(usb_enum, "get_string", fake_get_string)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_stm32_bootloader(self):
+        # dfu-util -l: Found DFU: [0483:df11] ver=2200, devnum=12, cfg=1, intf=0, path="1-1.2", alt=1, name="@Option Bytes  /0x1FFFC000/01*016 e", serial="356C38703434"
+        dev = FakeDevice(0x0483, 0xDF11, bus=1, port_numbers=(1, 2), address=12, bcdDevice=0x2200, serial="356C38703434",
+            configs=[FakeConfig(1, [
+                FakeInterface(0, 0, usb_enum.DFU_CLASS, usb_enum.DFU_SUBCLASS, iInterface=4),
+                FakeInterface(0, 1, usb_enum.DFU_CLASS, usb_enum.DFU_SUBCLASS, iInterface=5),
+            ])],
+            strings={4: "@Internal Flash  /0x08000000/04*016Kg,01*064Kg,07*128Kg", 5: "@Option Bytes  /0x1FFFC000/01*016 e"},
+        )
+        self.assertEqual(usb_enum.list_dfu([dev]), [
+            '[0483:df11] ver=2200, devnum=12, cfg=1, intf=0, path="1-1.2", alt=0, name="@Internal Flash  /0x08000000/04*016Kg,01*064Kg,07*128Kg", serial="356C38703434"',
+            '[0483:df11] ver=2200, devnum=12, cfg=1, intf=0, path="1-1.2", alt=1, name="@Option Bytes  /0x1FFFC000/01*016 e", serial="356C38703434"',
+        ])
+
+    def test_unreadable_strings(self):
+        dev = FakeDevice(0x1209, 0x0001, bus=3, port_numbers=(4,), address=7,
+            configs=[FakeConfig(1, [FakeInterface(0, 0, usb_enum.DFU_CLASS, usb_enum.DFU_SUBCLASS)])])
+        self.assertEqual(usb_enum.list_dfu([dev]), [
+            '[1209:0001] ver=0100, devnum=7, cfg=1, intf=0, path="3-4", alt=0, name="UNKNOWN", serial="UNKNOWN"',
+        ])
+
+    def test_skips_other_interfaces(self):
+        cdc = FakeDevice(0x2341, 0x0043, configs=[FakeConfig(1, [FakeInterface(0, 0, 0x02, 0x02), FakeInterface(1, 0, 0x0A, 0x00)])])
+        self.assertEqual(usb_enum.list_dfu([cdc]), [])
+
+    def test_path_without_port_numbers(self):
+        dev = FakeDevice(0x0483, 0xDF11, bus=2, port_numbers=None,
+            configs=[FakeConfig(1, [FakeInterface(0, 0, usb_enum.DFU_CLASS, usb_enum.DFU_SUBCLASS)])])
+        self.assertIn('path="2"', usb_enum.list_dfu([dev])[0])
+
+class ListProbesTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(usb_enum, "get_string", fake_get_string)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.devices = [
+            FakeDevice(0x0D28, 0x0204, serial="0240000034544e45001b00028aa9001e8da1000097969900", product="DAPLink CMSIS-DAP"),
+            FakeDevice(0xC251, 0xF002, serial="ABC123", product="Some HID device"),
+            FakeDevice(0x1366, 0x0105, serial="000683123456", product="J-Link"),
+            FakeDevice(0x0483, 0x374B, serial="066DFF555185754867113137", product="STM32 STLink"),
+            FakeDevice(0x0483, 0xDF11, serial="356C38703434", product="STM32  BOOTLOADER"),
+        ]
+
+    def test_cmsis_dap(self):
+        # openocd -d3: CMSIS-DAP: Serial# = 0240000034544e45001b00028aa9001e8da1000097969900
+        self.assertEqual(usb_enum.list_probes("cmsis-dap", self.devices), ["0240000034544e45001b00028aa9001e8da1000097969900"])
+
+    def test_jlink(self):
+        # openocd -d3: Device: Serial number = 683123456
+        self.assertEqual(usb_enum.list_probes("jlink", self.devices), ["683123456"])
+
+    def test_stlink(self):
+        # the DFU bootloader shares the ST vendor id but isn't a probe
+        self.assertEqual(usb_enum.list_probes("stlink", self.devices), ["066DFF555185754867113137"])
+
+    def test_probe_without_serial(self):
+        self.assertEqual(usb_enum.list_probes("jlink", [FakeDevice(0x1366, 0x0101)]), [])
+
+    def test_unknown_kind(self):
+        self.assertIsNone(usb_enum.list_probes(None, self.devices))
+        self.assertIsNone(usb_enum.list_probes("ftdi", self.devices))
+
+class ProbeKindTest(unittest.TestCase):
+    def test_interface_scripts(self):
+        self.assertEqual(usb_enum.probe_kind("cmsis-dap.cfg"), "cmsis-dap")
+        self.assertEqual(usb_enum.probe_kind("/usr/share/openocd/scripts/interface/jlink.cfg"), "jlink")
+        self.assertEqual(usb_enum.probe_kind("C:\\openocd\\scripts\\interface\\stlink-dap.cfg"), "stlink")
+        self.assertEqual(usb_enum.probe_kind("st-link.cfg"), "stlink")
+        self.assertEqual(usb_enum.probe_kind("CMSIS-DAP.cfg"), "cmsis-dap")
+        self.assertIsNone(usb_enum.probe_kind("ftdi/olimex-arm-usb-ocd-h.cfg"))
+
+if __name__ == "__main__":
+    unittest.main()